@@ -1,9 +1,11 @@
+import html
 import database as db
 from aiogram import Bot
 from config import GROUP_ID
-from utils.safe_sender import send_message_safely
+import outbox
 
 SIGNIFICANT_ACHIEVEMENTS = ['marathoner', 'stability']
+GROUP_POST_MAX_NAMES = 50  # скільки імен перелічувати у зведеному пості в групу
 
 ACHIEVEMENTS = {
     'novice': {'name': '🎓 Новачок', 'description': 'Створили свій перший фітнес-план!'},
@@ -20,7 +22,7 @@ async def check_and_grant_achievement(user_id: int, achievement_id: str, bot: Bo
         achievement = ACHIEVEMENTS[achievement_id]
         
         # Надсилаємо особисте повідомлення
-        await send_message_safely(bot, user_id, f"🎉 **Нове досягнення!** 🎉\n\nВи отримали ачівку: **{achievement['name']}**\n_{achievement['description']}_")
+        await outbox.enqueue(user_id, f"🎉 **Нове досягнення!** 🎉\n\nВи отримали ачівку: **{achievement['name']}**\n_{achievement['description']}_")
 
         # --- Повідомлення у спільноту ---
         if GROUP_ID:
@@ -32,16 +34,44 @@ async def check_and_grant_achievement(user_id: int, achievement_id: str, bot: Bo
                     f"{username} отримав(ла) ачівку: <b>{achievement['name']}</b>\n"
                     f"<i>{achievement['description']}</i>"
                 )
-                await send_message_safely(bot, int(GROUP_ID), group_message, parse_mode="HTML")
+                await outbox.enqueue(int(GROUP_ID), group_message, parse_mode="HTML")
             except Exception as e:
                 import traceback
                 print(f"Не вдалося відправити у групу: {e}")
                 traceback.print_exc()
 
 
+async def grant_achievement_in_bulk(achievement_id: str, registered_before: str) -> int:
+    """
+    Видає досягнення всім, хто зареєструвався до registered_before, і ставить привітання в outbox:
+    кожному особисто та одне спільне повідомлення в групу.
+    """
+    granted = await db.grant_achievement_in_bulk(achievement_id, registered_before)
+    achievement = ACHIEVEMENTS[achievement_id]
+    deliveries = [
+        (user_id, f"🎉 **Нове досягнення!** 🎉\n\nВи отримали ачівку: **{achievement['name']}**\n_{achievement['description']}_", {})
+        for user_id, _, _ in granted
+    ]
+    if GROUP_ID and granted:
+        # Окремий пост на кожного впирається у флуд-ліміт групи, тому одне зведене повідомлення
+        names = [html.escape(f"@{username}" if username else full_name or "") for _, username, full_name in granted]
+        shown = ", ".join(names[:GROUP_POST_MAX_NAMES])
+        if len(names) > GROUP_POST_MAX_NAMES:
+            shown += f" та ще {len(names) - GROUP_POST_MAX_NAMES}"
+        group_message = (
+            f" <b>Нові досягнення!</b> \n\n"
+            f"Ачівку <b>{achievement['name']}</b> отримали: {shown}\n"
+            f"<i>{achievement['description']}</i>"
+        )
+        deliveries.append((int(GROUP_ID), group_message, {"parse_mode": "HTML"}))
+    await outbox.enqueue_many(deliveries)
+    return len(granted)
+
+
 async def check_workout_achievements(user_id: int, bot: Bot):
-    if await db.count_total_workouts(user_id) == 1:
+    stats = await db.get_workout_stats(user_id)
+    if stats and stats['total'] == 1:
         await check_and_grant_achievement(user_id, 'first_step', bot)
-    if await db.count_workouts_last_n_days(user_id, 7) >= 3:
+    if db.count_recent_workouts(stats, 7) >= 3:
         await check_and_grant_achievement(user_id, 'stability', bot)
 
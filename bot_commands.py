@@ -7,6 +7,7 @@ async def set_bot_commands(bot: Bot):
         BotCommand(command="myplan", description="Переглянути ваш поточний план"),
         BotCommand(command="progress", description="Ваша статистика тренувань"),
         BotCommand(command="achievements", description="Мої досягнення"),
+        BotCommand(command="leaderboard", description="Лідерборд тижня"),
         BotCommand(command="challenges", description="Виклики спільноти"),
         BotCommand(command="create_challenge", description="Створити публічний виклик"),
         BotCommand(command="duel", description="Кинути дуель іншому учаснику"),
@@ -1,184 +1,330 @@
 import aiosqlite
+import asyncio
 import json
 import os
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable
 import pytz
+from cachetools import TTLCache
+import migrations
 
 # --- Налаштування ---
 DB_NAME = 'fitness_bot.db'
 KYIV_TZ = pytz.timezone("Europe/Kiev")
+READER_POOL_SIZE = 4
+WRITE_BATCH_SIZE = 200
+WRITE_BATCH_DELAY = 0.005  # секунд очікування на наповнення пакету
+SUBSCRIPTION_CACHE_TTL = 300  # секунд
+SUBSCRIPTION_CACHE_SIZE = 10_000
+USER_PAGE_SIZE = 500  # користувачів за один запит при обході всієї бази
+WORKOUT_WINDOW_DAYS = 31  # скільки днів історії тримає workout_stats
+FREQUENT_MEALS_KEEP = 20  # скільки останніх різних страв користувача тримає frequent_meals
+
+# --- Пул з'єднань ---
+# Одне з'єднання для запису (SQLite все одно серіалізує записи) та кілька
+# з'єднань для читання. Відкриваються один раз в init_db і живуть до close_db.
+
+_writer: aiosqlite.Connection | None = None
+_writer_lock = asyncio.Lock()
+_readers: asyncio.Queue | None = None
+_pool_lock = asyncio.Lock()
+
+async def _open_connection() -> aiosqlite.Connection:
+    """Відкриває з'єднання з налаштуваннями WAL та спільною row_factory."""
+    conn = await aiosqlite.connect(DB_NAME)
+    conn.row_factory = aiosqlite.Row
+    await conn.execute("PRAGMA journal_mode = WAL")
+    await conn.execute("PRAGMA synchronous = NORMAL")
+    await conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+async def open_pool():
+    """Відкриває пул з'єднань, якщо він ще не відкритий."""
+    global _writer, _readers
+    async with _pool_lock:
+        if _writer is not None:
+            return
+        _writer = await _open_connection()
+        readers = asyncio.Queue()
+        for _ in range(READER_POOL_SIZE):
+            readers.put_nowait(await _open_connection())
+        _readers = readers
+
+async def close_db():
+    """Дописує відкладені записи та закриває всі з'єднання пулу. Викликається при зупинці бота."""
+    global _writer, _readers
+    await flush_writes()
+    async with _pool_lock:
+        if _writer is None:
+            return
+        async with _writer_lock:
+            await _writer.close()
+            _writer = None
+        while not _readers.empty():
+            await _readers.get_nowait().close()
+        _readers = None
+
+@asynccontextmanager
+async def _write():
+    """Видає з'єднання для запису; комітить при успіху і відкочує при помилці."""
+    if _writer is None:
+        await open_pool()
+    async with _writer_lock:
+        try:
+            yield _writer
+            await _writer.commit()
+        except BaseException:
+            await _writer.rollback()
+            raise
+
+@asynccontextmanager
+async def _read():
+    """Бере з'єднання для читання з пулу та повертає його назад."""
+    if _readers is None:
+        await open_pool()
+    readers = _readers
+    conn = await readers.get()
+    try:
+        yield conn
+    finally:
+        readers.put_nowait(conn)
+
+# --- Відкладений пакетний запис ---
+# Часті вставки (тренування, їжа, досягнення) не комітяться поодинці, а
+# збираються в пакет і комітяться однією транзакцією кожні WRITE_BATCH_DELAY
+# секунд або щойно набереться WRITE_BATCH_SIZE операцій. Кожна операція
+# отримує свій future: await на ньому чекає, доки запис стане надійним.
+
+WriteOp = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+_pending_writes: list[tuple[WriteOp, asyncio.Future]] = []
+_batch_full = asyncio.Event()
+_flusher_task: asyncio.Task | None = None
+
+def _queue_write(op: WriteOp) -> asyncio.Future:
+    """Додає операцію в чергу запису та повертає future з її результатом."""
+    global _flusher_task
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _pending_writes.append((op, future))
+    if len(_pending_writes) >= WRITE_BATCH_SIZE:
+        _batch_full.set()
+    if _flusher_task is None or _flusher_task.done():
+        _flusher_task = loop.create_task(_write_behind_loop())
+    return future
+
+async def _write_behind_loop():
+    """Скидає пакети, доки черга не спорожніє."""
+    while _pending_writes:
+        try:
+            await asyncio.wait_for(_batch_full.wait(), WRITE_BATCH_DELAY)
+        except asyncio.TimeoutError:
+            pass
+        _batch_full.clear()
+        await _flush_batch()
+
+async def _flush_batch():
+    batch = _pending_writes[:WRITE_BATCH_SIZE]
+    del _pending_writes[:len(batch)]
+    if not batch:
+        return
+
+    try:
+        await _write_batch(batch)
+    except asyncio.CancelledError:
+        for _, future in batch:
+            future.cancel()
+        raise
+    except Exception as e:
+        # Не вдалося навіть відкрити з'єднання - очікувачі отримують помилку, а не висять,
+        # а наступні пакети пишуться далі
+        print(f"[DB] Не вдалося записати пакет з {len(batch)} операцій: {e}")
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+
+async def _write_batch(batch: list[tuple[WriteOp, asyncio.Future]]):
+    try:
+        async with _write() as db:
+            results = [await op(db) for op, _ in batch]
+    except Exception:
+        # Пакет відкочено. Повторюємо операції поодинці, щоб помилка
+        # однієї не загубила решту.
+        for op, future in batch:
+            try:
+                async with _write() as db:
+                    result = await op(db)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+        return
+
+    for (_, future), result in zip(batch, results):
+        if not future.done():
+            future.set_result(result)
+
+async def flush_writes():
+    """Негайно записує всі операції з черги."""
+    while _pending_writes:
+        await _flush_batch()
+
+# --- Час ---
+# Часові мітки зберігаються як цілі секунди epoch (UTC), межі діб
+# рахуються за київським часом.
+
+def to_epoch(dt: datetime) -> int:
+    """Переводить datetime у секунди epoch; дати без зони вважаються київськими."""
+    if dt.tzinfo is None:
+        dt = KYIV_TZ.localize(dt)
+    return int(dt.timestamp())
+
+def from_epoch(ts: int) -> datetime:
+    """Переводить секунди epoch у київський datetime."""
+    return datetime.fromtimestamp(ts, KYIV_TZ)
+
+def now_epoch() -> int:
+    return to_epoch(datetime.now(KYIV_TZ))
+
+def day_number(ts: int | None = None) -> int:
+    """Порядковий номер київської доби для мітки ts (за замовчуванням - сьогодні)."""
+    dt = from_epoch(ts) if ts is not None else datetime.now(KYIV_TZ)
+    return dt.date().toordinal()
+
+def week_number(ts: int | None = None) -> int:
+    """Номер тижня (порядковий номер його понеділка) для мітки ts."""
+    day = day_number(ts)
+    return day - datetime.fromordinal(day).weekday()
+
+def day_start_epoch(dt: datetime | None = None) -> int:
+    """Початок київської доби для dt (за замовчуванням - сьогодні)."""
+    dt = dt.astimezone(KYIV_TZ) if dt else datetime.now(KYIV_TZ)
+    midnight = KYIV_TZ.localize(dt.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None))
+    return to_epoch(midnight)
 
 # --- Ініціалізація та структура БД ---
 
 async def init_db():
-    """Створює всі необхідні таблиці та виконує міграції, якщо потрібно."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
-        
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                full_name TEXT,
-                registration_date TEXT,
-                onboarding_data TEXT,
-                fitness_plan TEXT,
-                plan_start_date TEXT,
-                subscription_status TEXT DEFAULT 'none',
-                subscription_expiry_date TEXT,
-                is_active BOOLEAN DEFAULT TRUE,
-                in_group BOOLEAN DEFAULT FALSE,
-                reminder_breakfast TEXT DEFAULT '09:00',
-                reminder_lunch TEXT DEFAULT '14:00',
-                reminder_dinner TEXT DEFAULT '19:00',
-                daily_activity_level TEXT
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS food_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                meal_description TEXT,
-                calories INTEGER,
-                proteins REAL,
-                fats REAL,
-                carbs REAL,
-                created_at TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS progress (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                date TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS achievements (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                achievement_id TEXT,
-                date_achieved TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
-                UNIQUE(user_id, achievement_id)
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS pending_payments (
-                user_id INTEGER PRIMARY KEY,
-                payment_code TEXT,
-                created_at TEXT
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS public_challenges (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                author_id INTEGER,
-                title TEXT,
-                description TEXT,
-                duration_days INTEGER,
-                created_at TEXT,
-                is_active BOOLEAN DEFAULT TRUE
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS challenge_participants (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                challenge_id INTEGER,
-                user_id INTEGER,
-                progress_days INTEGER DEFAULT 0,
-                last_completion_date TEXT,
-                FOREIGN KEY (challenge_id) REFERENCES public_challenges (id) ON DELETE CASCADE,
-                FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
-                UNIQUE(challenge_id, user_id)
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS duels (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                initiator_id INTEGER,
-                opponent_id INTEGER,
-                description TEXT,
-                status TEXT DEFAULT 'pending',
-                created_at TEXT,
-                initiator_completed BOOLEAN DEFAULT FALSE,
-                opponent_completed BOOLEAN DEFAULT FALSE,
-                winner_id INTEGER
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS user_results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                photo_file_id TEXT NOT NULL,
-                date_added TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
-            )''')
-        
-        # --- Проста міграція для таблиці duels ---
-        cursor = await db.execute("PRAGMA table_info(duels)")
-        columns = [row[1] for row in await cursor.fetchall()]
-        
-        if 'initiator_completed' not in columns:
-            print("Виконую міграцію: додаю колонку 'initiator_completed' до таблиці 'duels'.")
-            await db.execute("ALTER TABLE duels ADD COLUMN initiator_completed BOOLEAN DEFAULT FALSE")
-        
-        if 'opponent_completed' not in columns:
-            print("Виконую міграцію: додаю колонку 'opponent_completed' до таблиці 'duels'.")
-            await db.execute("ALTER TABLE duels ADD COLUMN opponent_completed BOOLEAN DEFAULT FALSE")
-        
-        await db.commit()
+    """Відкриває пул та доводить схему БД до актуальної версії."""
+    await open_pool()
+    async with _write() as db:
+        await migrations.migrate(db)
 
 # --- Робота з користувачами ---
 
-async def add_user(user_id: int, username: str, full_name: str):
-    """Додає нового користувача або оновлює дані існуючого."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+async def add_user(user_id: int, username: str, full_name: str) -> bool:
+    """
+    Додає нового користувача або оновлює дані існуючого (і знову робить його активним).
+    Повертає True, якщо користувач новий.
+    """
+    async with _write() as db:
         cursor = await db.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-        if await cursor.fetchone() is None:
+        is_new_user = await cursor.fetchone() is None
+        if is_new_user:
             now = datetime.now(KYIV_TZ)
-            trial_expiry = (now + timedelta(days=7)).isoformat()
+            trial_expiry = to_epoch(now + timedelta(days=7))
             await db.execute(
-                "INSERT INTO users (user_id, username, full_name, registration_date, subscription_status, subscription_expiry_date) VALUES (?, ?, ?, ?, 'trial', ?)",
+                "INSERT INTO users (user_id, username, full_name, registration_date, subscription_status, subscription_expiry_ts) VALUES (?, ?, ?, ?, 'trial', ?)",
                 (user_id, username, full_name, now.isoformat(), trial_expiry)
             )
         else:
             await db.execute(
-                "UPDATE users SET username = ?, full_name = ? WHERE user_id = ?",
+                "UPDATE users SET username = ?, full_name = ?, is_active = TRUE, deactivated_ts = NULL WHERE user_id = ?",
                 (username, full_name, user_id)
             )
-        await db.commit()
+    invalidate_subscription_cache(user_id)
+    return is_new_user
+
+async def _deactivate_users(db: aiosqlite.Connection, user_ids: list[int]):
+    placeholders = ", ".join("?" * len(user_ids))
+    await db.execute(
+        f"UPDATE users SET is_active = FALSE, deactivated_ts = ? WHERE is_active = TRUE AND user_id IN ({placeholders})",
+        [now_epoch(), *user_ids]
+    )
+
+async def deactivate_users(user_ids: list[int]):
+    """Виключає з розсилок користувачів, які заблокували бота або видалили акаунт."""
+    if not user_ids:
+        return
+    async with _write() as db:
+        await _deactivate_users(db, user_ids)
+
+async def count_deactivated_users(since_ts: int = 0) -> int:
+    """Рахує деактивованих користувачів (з since_ts, якщо передано)."""
+    async with _read() as db:
+        cursor = await db.execute("SELECT COUNT(*) FROM users WHERE deactivated_ts >= ?", (since_ts,))
+        row = await cursor.fetchone()
+        return row[0]
 
 async def get_user_by_username(username: str):
     """Знаходить користувача за його username."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT * FROM users WHERE username = ?", (username,))
+    async with _read() as db:
+        cursor = await db.execute("SELECT * FROM users WHERE username = ? COLLATE NOCASE", (username,))
         return await cursor.fetchone()
 
-async def get_all_active_users():
-    """Повертає список всіх активних користувачів."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT user_id, registration_date, plan_start_date FROM users WHERE is_active = TRUE")
-        return await cursor.fetchall()
-
-async def get_users_not_in_group():
-    """Повертає користувачів, які ще не в групі."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT user_id FROM users WHERE in_group = FALSE")
-        return await cursor.fetchall()
+async def _iter_users(query: str, batch_size: int, after_user_id: int = 0, params: tuple = ()):
+    """
+    Посторінково обходить користувачів за ключем (user_id > останній),
+    не тримаючи з'єднання між сторінками. Запит має містити умову
+    "user_id > ?", сортування за user_id та LIMIT ?; params передаються перед ними.
+    """
+    last_user_id = after_user_id
+    while True:
+        async with _read() as db:
+            cursor = await db.execute(query, (*params, last_user_id, batch_size))
+            rows = await cursor.fetchall()
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        last_user_id = rows[-1]['user_id']
+
+def iter_active_users(after_user_id: int = 0, batch_size: int = USER_PAGE_SIZE):
+    """Асинхронно перебирає активних користувачів з user_id > after_user_id."""
+    return _iter_users(
+        "SELECT user_id, registration_date, plan_start_date FROM users "
+        "WHERE is_active = TRUE AND user_id > ? ORDER BY user_id LIMIT ?",
+        batch_size, after_user_id
+    )
+
+def iter_monthly_stats(after_user_id: int = 0, batch_size: int = USER_PAGE_SIZE):
+    """Асинхронно перебирає активних користувачів разом з їхнім рядком workout_stats (total, last_day, recent)."""
+    return _iter_users(
+        "SELECT u.user_id, ws.total, ws.last_day, ws.recent FROM users AS u "
+        "LEFT JOIN workout_stats AS ws ON ws.user_id = u.user_id "
+        "WHERE u.is_active = TRUE AND u.registration_date IS NOT NULL AND u.user_id > ? "
+        "ORDER BY u.user_id LIMIT ?",
+        batch_size, after_user_id
+    )
+
+def iter_daily_nutrition(day: int, after_user_id: int = 0, batch_size: int = USER_PAGE_SIZE):
+    """
+    Асинхронно перебирає активних користувачів з ціллю, рівнем активності та підсумками
+    харчування за день day (calories, proteins, fats, carbs, meals - None, якщо записів немає).
+    """
+    return _iter_users(
+        "SELECT u.user_id, u.daily_activity_level, "
+        "CASE WHEN json_valid(u.onboarding_data) THEN json_extract(u.onboarding_data, '$.goal') END AS goal, "
+        "dn.calories, dn.proteins, dn.fats, dn.carbs, dn.meals FROM users AS u "
+        "LEFT JOIN daily_nutrition AS dn ON dn.user_id = u.user_id AND dn.day = ? "
+        "WHERE u.is_active = TRUE AND u.user_id > ? ORDER BY u.user_id LIMIT ?",
+        batch_size, after_user_id, params=(day,)
+    )
+
+def iter_users_not_in_group(after_user_id: int = 0, batch_size: int = USER_PAGE_SIZE):
+    """Асинхронно перебирає активних користувачів, які ще не в групі, з user_id > after_user_id."""
+    return _iter_users(
+        "SELECT user_id FROM users WHERE in_group = FALSE AND is_active = TRUE AND user_id > ? ORDER BY user_id LIMIT ?",
+        batch_size, after_user_id
+    )
 
 async def set_user_in_group(user_id: int):
     """Відмічає, що користувач приєднався до групи."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+    async with _write() as db:
         await db.execute("UPDATE users SET in_group = TRUE WHERE user_id = ?", (user_id,))
-        await db.commit()
 
 async def is_admin(user_id: int) -> bool:
     """Перевіряє, чи є користувач адміністратором."""
@@ -194,26 +340,63 @@ async def is_admin(user_id: int) -> bool:
 # --- Робота з підписками та платежами ---
 
 async def get_user_subscription_status(user_id: int):
-    """Перевіряє статус підписки користувача та оновлює, якщо вона закінчилась."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT subscription_status, subscription_expiry_date FROM users WHERE user_id = ?", (user_id,))
+    """
+    Повертає статус підписки користувача. Нічого не записує: прострочена
+    підписка повертається як 'expired', а в БД її переводить expire_lapsed_subscriptions.
+    """
+    async with _read() as db:
+        cursor = await db.execute("SELECT subscription_status, subscription_expiry_ts FROM users WHERE user_id = ?", (user_id,))
         row = await cursor.fetchone()
         if not row:
             return 'none', None
         
-        status, expiry_str = row['subscription_status'], row['subscription_expiry_date']
-        if not expiry_str:
+        status, expiry_ts = row['subscription_status'], row['subscription_expiry_ts']
+        if not expiry_ts:
             return status, None
 
-        expiry = datetime.fromisoformat(expiry_str)
+        expiry = from_epoch(expiry_ts)
         if status in ['trial', 'active'] and datetime.now(KYIV_TZ) > expiry:
-            await db.execute("UPDATE users SET subscription_status = 'expired' WHERE user_id = ?", (user_id,))
-            await db.commit()
             return 'expired', expiry
         return status, expiry
 
+async def expire_lapsed_subscriptions() -> list[int]:
+    """
+    Переводить усі прострочені пробні та активні підписки в 'expired'.
+    Повертає ID тих із цих користувачів, яких ще варто сповістити (не деактивованих).
+    """
+    async with _write() as db:
+        cursor = await db.execute(
+            "UPDATE users SET subscription_status = 'expired' "
+            "WHERE subscription_status IN ('trial', 'active') AND subscription_expiry_ts < ? "
+            "RETURNING user_id, is_active",
+            (now_epoch(),)
+        )
+        rows = await cursor.fetchall()
+    for row in rows:
+        invalidate_subscription_cache(row['user_id'])
+    return [row['user_id'] for row in rows if row['is_active']]
+
+# Кеш (status, expiry) для SubscriptionMiddleware. Закінчення терміну
+# перевіряється по збереженій даті, тож запис лишається коректним до TTL.
+# Будь-яка зміна підписки має скидати запис через invalidate_subscription_cache.
+_subscription_cache: TTLCache = TTLCache(maxsize=SUBSCRIPTION_CACHE_SIZE, ttl=SUBSCRIPTION_CACHE_TTL)
+
+async def get_cached_subscription_status(user_id: int):
+    """Повертає статус підписки з кешу, звертаючись до БД лише при промаху."""
+    cached = _subscription_cache.get(user_id)
+    if cached is None:
+        cached = await get_user_subscription_status(user_id)
+        _subscription_cache[user_id] = cached
+
+    status, expiry = cached
+    if status in ['trial', 'active'] and expiry and datetime.now(KYIV_TZ) > expiry:
+        return 'expired', expiry
+    return status, expiry
+
+def invalidate_subscription_cache(user_id: int):
+    """Скидає закешований статус підписки користувача."""
+    _subscription_cache.pop(user_id, None)
+
 async def update_user_subscription(user_id: int, months: int):
     """Оновлює або продовжує підписку користувача."""
     status, expiry = await get_user_subscription_status(user_id)
@@ -221,139 +404,127 @@ async def update_user_subscription(user_id: int, months: int):
     if status == 'active' and expiry and expiry > start:
         start = expiry
     
-    new_expiry = (start + timedelta(days=30 * months)).isoformat()
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
-        await db.execute("UPDATE users SET subscription_status = 'active', subscription_expiry_date = ? WHERE user_id = ?", (new_expiry, user_id))
-        await db.commit()
+    new_expiry = to_epoch(start + timedelta(days=30 * months))
+    async with _write() as db:
+        await db.execute("UPDATE users SET subscription_status = 'active', subscription_expiry_ts = ? WHERE user_id = ?", (new_expiry, user_id))
+    invalidate_subscription_cache(user_id)
 
 async def grant_lifetime_access(user_id: int):
     """Надає довічний доступ користувачу."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
-        far_future_date = (datetime.now() + timedelta(days=365 * 100)).isoformat()
+    async with _write() as db:
+        far_future_date = to_epoch(datetime.now(KYIV_TZ) + timedelta(days=365 * 100))
         await db.execute("INSERT OR IGNORE INTO users (user_id, registration_date) VALUES (?, ?)", (user_id, datetime.now(KYIV_TZ).isoformat()))
-        await db.execute("UPDATE users SET subscription_status = 'active', subscription_expiry_date = ? WHERE user_id = ?", (far_future_date, user_id))
-        await db.commit()
+        await db.execute("UPDATE users SET subscription_status = 'active', subscription_expiry_ts = ? WHERE user_id = ?", (far_future_date, user_id))
+    invalidate_subscription_cache(user_id)
 
 async def add_pending_payment(user_id: int, payment_code: str):
     """Зберігає код для очікуючого платежу."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+    async with _write() as db:
         await db.execute("INSERT OR REPLACE INTO pending_payments (user_id, payment_code, created_at) VALUES (?, ?, ?)", (user_id, payment_code, datetime.now(KYIV_TZ).isoformat()))
-        await db.commit()
 
 async def get_pending_payment_code(user_id: int) -> str | None:
     """Отримує код очікуючого платежу."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cursor = await db.execute("SELECT payment_code FROM pending_payments WHERE user_id = ?", (user_id,))
         row = await cursor.fetchone()
         return row['payment_code'] if row else None
 
 async def delete_pending_payment(user_id: int):
     """Видаляє очікуючий платіж."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+    async with _write() as db:
         await db.execute("DELETE FROM pending_payments WHERE user_id = ?", (user_id,))
-        await db.commit()
 
 # --- Робота з челенджами ---
 
 async def create_public_challenge(author_id: int, title: str, description: str, duration: int) -> int:
     """Створює новий публічний челендж і повертає його ID."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+    now = datetime.now(KYIV_TZ)
+    async with _write() as db:
         cursor = await db.execute(
-            "INSERT INTO public_challenges (author_id, title, description, duration_days, created_at) VALUES (?, ?, ?, ?, ?)",
-            (author_id, title, description, duration, datetime.now(KYIV_TZ).isoformat())
+            "INSERT INTO public_challenges (author_id, title, description, duration_days, created_at, expires_ts) VALUES (?, ?, ?, ?, ?, ?)",
+            (author_id, title, description, duration, now.isoformat(), to_epoch(now + timedelta(days=duration)))
         )
-        await db.commit()
         return cursor.lastrowid
 
 async def get_public_challenges():
     """Повертає список активних публічних челенджів."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cursor = await db.execute("SELECT id, title FROM public_challenges WHERE is_active = TRUE ORDER BY id DESC")
         return await cursor.fetchall()
 
 async def get_public_challenge_details(challenge_id: int):
     """Повертає детальну інформацію про челендж."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cursor = await db.execute("SELECT * FROM public_challenges WHERE id = ?", (challenge_id,))
         return await cursor.fetchone()
 
 async def join_public_challenge(user_id: int, challenge_id: int):
     """Додає користувача до учасників челенджу."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+    async with _write() as db:
         await db.execute("INSERT OR IGNORE INTO challenge_participants (challenge_id, user_id) VALUES (?, ?)", (challenge_id, user_id))
-        await db.commit()
 
 async def get_user_challenge_progress(user_id: int, challenge_id: int):
     """Отримує прогрес користувача в конкретному челенджі."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cursor = await db.execute("SELECT progress_days, last_completion_date FROM challenge_participants WHERE user_id = ? AND challenge_id = ?", (user_id, challenge_id))
         return await cursor.fetchone()
 
 async def update_challenge_progress(user_id: int, challenge_id: int):
     """Оновлює прогрес користувача в челенджі, збільшуючи лічильник на 1."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+    async with _write() as db:
         await db.execute(
             "UPDATE challenge_participants SET progress_days = progress_days + 1, last_completion_date = ? WHERE user_id = ? AND challenge_id = ?",
             (datetime.now(KYIV_TZ).isoformat(), user_id, challenge_id)
         )
-        await db.commit()
 
 async def delete_challenge(challenge_id: int):
     """
     Видаляє челендж та всіх його учасників.
     Спочатку видаляє учасників, потім сам челендж для надійності.
     """
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+    async with _write() as db:
         await db.execute("DELETE FROM challenge_participants WHERE challenge_id = ?", (challenge_id,))
         await db.execute("DELETE FROM public_challenges WHERE id = ?", (challenge_id,))
-        await db.commit()
         print(f"Challenge {challenge_id} and its participants have been deleted from the database.")
 
 
+async def delete_expired_challenges() -> list[int]:
+    """Видаляє всі челенджі з минулим терміном дії разом з учасниками одною транзакцією."""
+    now = now_epoch()
+    async with _write() as db:
+        await db.execute(
+            "DELETE FROM challenge_participants WHERE challenge_id IN "
+            "(SELECT id FROM public_challenges WHERE expires_ts <= ?)",
+            (now,)
+        )
+        cursor = await db.execute("DELETE FROM public_challenges WHERE expires_ts <= ? RETURNING id", (now,))
+        return [row[0] for row in await cursor.fetchall()]
+
 # --- Робота з дуелями ---
 
 async def create_duel(initiator_id: int, opponent_id: int, description: str) -> int:
     """Створює нову дуель."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+    async with _write() as db:
         cursor = await db.execute(
             "INSERT INTO duels (initiator_id, opponent_id, description, created_at) VALUES (?, ?, ?, ?)",
             (initiator_id, opponent_id, description, datetime.now(KYIV_TZ).isoformat())
         )
-        await db.commit()
         return cursor.lastrowid
 
 async def get_duel_by_id(duel_id: int):
     """Отримує інформацію про дуель за її ID."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cursor = await db.execute("SELECT * FROM duels WHERE id = ?", (duel_id,))
         return await cursor.fetchone()
 
 async def update_duel_status(duel_id: int, status: str):
     """Оновлює статус дуелі (pending, active, completed, rejected)."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+    async with _write() as db:
         await db.execute("UPDATE duels SET status = ? WHERE id = ?", (status, duel_id))
-        await db.commit()
 
 async def mark_duel_completed(user_id: int, duel_id: int):
     """Відмічає, що один з учасників виконав своє завдання в дуелі."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
-        db.row_factory = aiosqlite.Row
+    async with _write() as db:
         cursor = await db.execute("SELECT initiator_id, opponent_id FROM duels WHERE id = ?", (duel_id,))
         duel = await cursor.fetchone()
         if not duel:
@@ -362,106 +533,290 @@ async def mark_duel_completed(user_id: int, duel_id: int):
             await db.execute("UPDATE duels SET initiator_completed = TRUE WHERE id = ?", (duel_id,))
         elif user_id == duel['opponent_id']:
             await db.execute("UPDATE duels SET opponent_completed = TRUE WHERE id = ?", (duel_id,))
-        await db.commit()
 
 # --- Інші функції (плани, досягнення, їжа, тощо) ---
 
 async def save_onboarding_data(user_id: int, data: dict):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+    async with _write() as db:
         await db.execute("UPDATE users SET onboarding_data = ? WHERE user_id = ?", (json.dumps(data), user_id))
-        await db.commit()
 
 async def get_user_onboarding_data(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cursor = await db.execute("SELECT onboarding_data FROM users WHERE user_id = ?", (user_id,))
         row = await cursor.fetchone()
         return json.loads(row['onboarding_data']) if row and row['onboarding_data'] else None
 
 async def save_fitness_plan(user_id: int, plan: str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+    async with _write() as db:
         await db.execute(
             "UPDATE users SET fitness_plan = ?, plan_start_date = ? WHERE user_id = ?",
             (plan, datetime.now(KYIV_TZ).isoformat(), user_id)
         )
-        await db.commit()
 
 async def get_user_plan(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cursor = await db.execute("SELECT fitness_plan FROM users WHERE user_id = ?", (user_id,))
         row = await cursor.fetchone()
         return row['fitness_plan'] if row else None
 
-async def log_workout_completion(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
-        await db.execute("INSERT INTO progress (user_id, date) VALUES (?, ?)", (user_id, datetime.now(KYIV_TZ).isoformat()))
-        await db.commit()
+# workout_stats тримає для кожного користувача загальну кількість тренувань
+# та лічильники по днях за останні WORKOUT_WINDOW_DAYS днів: recent[i] -
+# кількість тренувань у день last_day - i (не більше 255 на день).
+
+def shift_workout_history(recent: bytes, last_day: int, today: int) -> bytearray:
+    """Зсуває денну історію так, щоб індекс 0 відповідав дню today."""
+    shift = today - last_day
+    history = bytearray(WORKOUT_WINDOW_DAYS)
+    for i, count in enumerate(recent):
+        if 0 <= i + shift < WORKOUT_WINDOW_DAYS:
+            history[i + shift] = count
+    return history
+
+def count_recent_workouts(stats, days: int, today: int | None = None) -> int:
+    """Кількість тренувань за останні days днів (включно з сьогоднішнім) з рядка workout_stats."""
+    if not stats or not stats['recent']:
+        return 0
+    history = shift_workout_history(stats['recent'], stats['last_day'], today or day_number())
+    return sum(history[:days])
+
+def log_workout_completion(user_id: int) -> asyncio.Future:
+    """
+    Ставить запис тренування в чергу пакетного запису та оновлює лічильники
+    workout_stats і weekly_workouts. Future повертає кількість тренувань за поточний тиждень.
+    """
+    async def op(db: aiosqlite.Connection):
+        now = now_epoch()
+        today = day_number(now)
+        await db.execute("INSERT INTO progress (user_id, date_ts) VALUES (?, ?)", (user_id, now))
+
+        cursor = await db.execute("SELECT total, last_day, recent FROM workout_stats WHERE user_id = ?", (user_id,))
+        stats = await cursor.fetchone()
+        if stats:
+            total = stats['total'] + 1
+            history = shift_workout_history(stats['recent'], stats['last_day'], today)
+        else:
+            total = 1
+            history = bytearray(WORKOUT_WINDOW_DAYS)
+        history[0] = min(history[0] + 1, 255)
+
+        await db.execute(
+            "INSERT OR REPLACE INTO workout_stats (user_id, total, last_day, recent) VALUES (?, ?, ?, ?)",
+            (user_id, total, today, bytes(history))
+        )
 
-async def has_completed_workout_today(user_id: int) -> bool:
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        today_start = datetime.now(KYIV_TZ).replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
         cursor = await db.execute(
-            "SELECT 1 FROM progress WHERE user_id = ? AND date >= ? LIMIT 1",
-            (user_id, today_start)
+            """
+            INSERT INTO weekly_workouts (week, user_id, workouts) VALUES (?, ?, 1)
+            ON CONFLICT (week, user_id) DO UPDATE SET workouts = workouts + 1
+            RETURNING workouts
+            """,
+            (week_number(now), user_id)
         )
-        return await cursor.fetchone() is not None
+        row = await cursor.fetchone()
+        return row['workouts']
+    return _queue_write(op)
+
+async def get_workout_stats(user_id: int):
+    """Повертає рядок workout_stats користувача (total, last_day, recent) або None."""
+    async with _read() as db:
+        cursor = await db.execute("SELECT total, last_day, recent FROM workout_stats WHERE user_id = ?", (user_id,))
+        return await cursor.fetchone()
+
+async def has_completed_workout_today(user_id: int) -> bool:
+    stats = await get_workout_stats(user_id)
+    return bool(stats) and stats['last_day'] == day_number()
 
-async def grant_achievement(user_id: int, achievement_id: str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
-        await db.execute("INSERT OR IGNORE INTO achievements (user_id, achievement_id, date_achieved) VALUES (?, ?, ?)", (user_id, achievement_id, datetime.now(KYIV_TZ).isoformat()))
-        await db.commit()
+def grant_achievement(user_id: int, achievement_id: str) -> asyncio.Future:
+    """Ставить видачу досягнення в чергу пакетного запису."""
+    async def op(db: aiosqlite.Connection):
+        await db.execute("INSERT OR IGNORE INTO achievements (user_id, achievement_id, achieved_ts) VALUES (?, ?, ?)", (user_id, achievement_id, now_epoch()))
+    return _queue_write(op)
+
+async def grant_achievement_in_bulk(achievement_id: str, registered_before: str):
+    """
+    Видає досягнення всім активним користувачам, зареєстрованим до registered_before (ISO),
+    одним INSERT OR IGNORE. Повертає (user_id, username, full_name) тих, хто отримав його вперше.
+    """
+    now = now_epoch()
+    async with _write() as db:
+        cursor = await db.execute(
+            "INSERT OR IGNORE INTO achievements (user_id, achievement_id, achieved_ts) "
+            "SELECT user_id, ?, ? FROM users WHERE is_active = TRUE AND registration_date <= ? "
+            "RETURNING user_id",
+            (achievement_id, now, registered_before)
+        )
+        granted = {row[0] for row in await cursor.fetchall()}
+        if not granted:
+            return []
+        cursor = await db.execute(
+            "SELECT u.user_id, u.username, u.full_name FROM achievements AS a JOIN users AS u ON u.user_id = a.user_id "
+            "WHERE a.achievement_id = ? AND a.achieved_ts = ?",
+            (achievement_id, now)
+        )
+        return [row for row in await cursor.fetchall() if row['user_id'] in granted]
 
 async def has_achievement(user_id: int, achievement_id: str) -> bool:
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cursor = await db.execute("SELECT 1 FROM achievements WHERE user_id = ? AND achievement_id = ?", (user_id, achievement_id))
         return await cursor.fetchone() is not None
 
 async def get_user_achievements(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cursor = await db.execute("SELECT achievement_id FROM achievements WHERE user_id = ?", (user_id,))
         return await cursor.fetchall()
 
-async def log_meal(user_id: int, description: str, calories: int, proteins: float, fats: float, carbs: float):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+def parse_calories(value) -> int:
+    """Переводить калорійність від Gemini у число; для діапазону на кшталт '300-400 ккал' бере середнє."""
+    if isinstance(value, str) and "-" in value:
+        parts = value.replace("ккал", "").split("-")
+        nums = [int(p.strip()) for p in parts if p.strip().isdigit()]
+        return sum(nums) // len(nums) if nums else 0
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return 0
+
+def parse_macro(value) -> float:
+    """Переводить значення білків/жирів/вуглеводів у число, ігноруючи некоректні."""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return 0.0
+
+def meal_key(description: str) -> str:
+    """Ключ страви в frequent_meals: без регістру та зайвих пробілів."""
+    return " ".join(str(description).casefold().split())
+
+def log_meal(user_id: int, description: str, calories: int, proteins: float, fats: float, carbs: float) -> asyncio.Future:
+    """
+    Ставить прийом їжі в чергу пакетного запису. У тій самій транзакції оновлює денні
+    підсумки та часті страви (лишаючи FREQUENT_MEALS_KEEP останніх різних страв).
+    """
+    async def op(db: aiosqlite.Connection):
+        now = now_epoch()
+        await db.execute(
+            "INSERT INTO food_log (user_id, meal_description, calories, proteins, fats, carbs, created_ts) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, description, calories, proteins, fats, carbs, now)
+        )
+        await db.execute(
+            """
+            INSERT INTO daily_nutrition (user_id, day, calories, proteins, fats, carbs, meals)
+            VALUES (?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT (user_id, day) DO UPDATE SET
+                calories = calories + excluded.calories,
+                proteins = proteins + excluded.proteins,
+                fats = fats + excluded.fats,
+                carbs = carbs + excluded.carbs,
+                meals = meals + 1
+            """,
+            (user_id, day_start_epoch(from_epoch(now)), parse_calories(calories),
+             parse_macro(proteins), parse_macro(fats), parse_macro(carbs))
+        )
+        await db.execute(
+            """
+            INSERT INTO frequent_meals (user_id, meal_key, description, calories, proteins, fats, carbs, last_used_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, meal_key) DO UPDATE SET
+                description = excluded.description,
+                calories = excluded.calories,
+                proteins = excluded.proteins,
+                fats = excluded.fats,
+                carbs = excluded.carbs,
+                uses = uses + 1,
+                last_used_ts = excluded.last_used_ts
+            """,
+            (user_id, meal_key(description), description, parse_calories(calories),
+             parse_macro(proteins), parse_macro(fats), parse_macro(carbs), now)
+        )
         await db.execute(
-            "INSERT INTO food_log (user_id, meal_description, calories, proteins, fats, carbs, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (user_id, description, calories, proteins, fats, carbs, datetime.now(KYIV_TZ).isoformat())
+            """
+            DELETE FROM frequent_meals WHERE user_id = ? AND id NOT IN (
+                SELECT id FROM frequent_meals WHERE user_id = ? ORDER BY last_used_ts DESC LIMIT ?
+            )
+            """,
+            (user_id, user_id, FREQUENT_MEALS_KEEP)
         )
-        await db.commit()
+    return _queue_write(op)
 
-async def get_daily_food_summary(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        today_start = datetime.now(KYIV_TZ).replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
+async def get_frequent_meals(user_id: int, limit: int):
+    """Найчастіші з останніх страв користувача (id, description, calories, proteins, fats, carbs)."""
+    async with _read() as db:
         cursor = await db.execute(
-            "SELECT meal_description, calories, proteins, fats, carbs FROM food_log WHERE user_id = ? AND created_at >= ?",
-            (user_id, today_start)
+            """
+            SELECT id, description, calories, proteins, fats, carbs FROM frequent_meals
+            WHERE user_id = ? ORDER BY uses DESC, last_used_ts DESC LIMIT ?
+            """,
+            (user_id, limit)
         )
         return await cursor.fetchall()
 
-async def add_user_result(user_id: int, photo_file_id: str):
-    """Додає фото результату користувача в базу даних."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+async def get_frequent_meal(user_id: int, meal_id: int):
+    """Збережена страва користувача за id або None."""
+    async with _read() as db:
+        cursor = await db.execute("SELECT * FROM frequent_meals WHERE user_id = ? AND id = ?", (user_id, meal_id))
+        return await cursor.fetchone()
+
+async def find_frequent_meal(user_id: int, description: str):
+    """Збережена страва користувача з таким самим описом (без регістру та зайвих пробілів) або None."""
+    async with _read() as db:
+        cursor = await db.execute(
+            "SELECT * FROM frequent_meals WHERE user_id = ? AND meal_key = ?", (user_id, meal_key(description))
+        )
+        return await cursor.fetchone()
+
+async def search_frequent_meals(user_id: int, prefix: str, limit: int):
+    """Збережені страви користувача, опис яких починається з prefix, найчастіші першими."""
+    key = meal_key(prefix)
+    async with _read() as db:
+        cursor = await db.execute(
+            """
+            SELECT id, description, calories, proteins, fats, carbs FROM frequent_meals
+            WHERE user_id = ? AND substr(meal_key, 1, ?) = ?
+            ORDER BY uses DESC, last_used_ts DESC LIMIT ?
+            """,
+            (user_id, len(key), key, limit)
+        )
+        return await cursor.fetchall()
+
+async def get_daily_nutrition(user_id: int):
+    """Повертає підсумки харчування користувача за сьогодні (calories, proteins, fats, carbs, meals) або None."""
+    async with _read() as db:
+        cursor = await db.execute(
+            "SELECT calories, proteins, fats, carbs, meals FROM daily_nutrition WHERE user_id = ? AND day = ?",
+            (user_id, day_start_epoch())
+        )
+        return await cursor.fetchone()
+
+async def get_cached_meal(key: str, created_after_ts: int) -> str | None:
+    """Повертає збережену відповідь аналізу страви, не старішу за created_after_ts."""
+    async with _read() as db:
+        cursor = await db.execute(
+            "SELECT response FROM meal_cache WHERE key = ? AND created_ts >= ?", (key, created_after_ts)
+        )
+        row = await cursor.fetchone()
+        return row['response'] if row else None
+
+def cache_meal(key: str, response: str) -> asyncio.Future:
+    """Ставить відповідь аналізу страви в чергу пакетного запису."""
+    async def op(db: aiosqlite.Connection):
+        await db.execute(
+            "INSERT OR REPLACE INTO meal_cache (key, response, created_ts) VALUES (?, ?, ?)",
+            (key, response, now_epoch())
+        )
+    return _queue_write(op)
+
+def add_user_result(user_id: int, photo_file_id: str) -> asyncio.Future:
+    """Ставить фото результату користувача в чергу пакетного запису."""
+    async def op(db: aiosqlite.Connection):
         await db.execute(
             "INSERT INTO user_results (user_id, photo_file_id, date_added) VALUES (?, ?, ?)",
             (user_id, photo_file_id, datetime.now(KYIV_TZ).isoformat())
         )
-        await db.commit()
+    return _queue_write(op)
 
 async def get_user_results(user_id: int):
     """Отримує всі фото результатів для конкретного користувача."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cursor = await db.execute(
             "SELECT photo_file_id FROM user_results WHERE user_id = ? ORDER BY date_added ASC",
             (user_id,)
@@ -470,60 +825,186 @@ async def get_user_results(user_id: int):
 
 async def set_meal_reminders(user_id: int, breakfast: str, lunch: str, dinner: str):
     """Встановлює час для нагадувань про прийоми їжі."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+    async with _write() as db:
         await db.execute(
             "UPDATE users SET reminder_breakfast = ?, reminder_lunch = ?, reminder_dinner = ? WHERE user_id = ?",
             (breakfast, lunch, dinner, user_id)
         )
-        await db.commit()
 
-async def get_all_user_reminders():
-    """Отримує налаштування нагадувань для всіх активних користувачів."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT user_id, reminder_breakfast, reminder_lunch, reminder_dinner FROM users WHERE is_active = TRUE")
+async def get_due_meal_reminders(reminder_time: str):
+    """Повертає (user_id, прийом їжі) активних користувачів з нагадуванням на reminder_time (HH:MM)."""
+    async with _read() as db:
+        cursor = await db.execute(
+            "SELECT user_id, 'breakfast' FROM users WHERE reminder_breakfast = ? AND is_active = TRUE "
+            "UNION ALL "
+            "SELECT user_id, 'lunch' FROM users WHERE reminder_lunch = ? AND is_active = TRUE "
+            "UNION ALL "
+            "SELECT user_id, 'dinner' FROM users WHERE reminder_dinner = ? AND is_active = TRUE",
+            (reminder_time, reminder_time, reminder_time)
+        )
         return await cursor.fetchall()
 
 async def count_total_workouts(user_id: int) -> int:
-    """Рахує загальну кількість тренувань користувача."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT COUNT(id) FROM progress WHERE user_id = ?", (user_id,))
-        row = await cursor.fetchone()
-        return row[0] if row else 0
+    """Повертає загальну кількість тренувань користувача."""
+    stats = await get_workout_stats(user_id)
+    return stats['total'] if stats else 0
 
 async def count_workouts_last_n_days(user_id: int, days: int) -> int:
-    """Рахує кількість тренувань за останні N днів."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        date_limit = (datetime.now(KYIV_TZ) - timedelta(days=days)).isoformat()
-        cursor = await db.execute("SELECT COUNT(id) FROM progress WHERE user_id = ? AND date >= ?", (user_id, date_limit))
+    """Рахує кількість тренувань за останні N днів, включно з сьогоднішнім."""
+    if days <= WORKOUT_WINDOW_DAYS:
+        return count_recent_workouts(await get_workout_stats(user_id), days)
+    async with _read() as db:
+        date_limit = day_start_epoch() - (days - 1) * 86400
+        cursor = await db.execute("SELECT COUNT(id) FROM progress WHERE user_id = ? AND date_ts >= ?", (user_id, date_limit))
         row = await cursor.fetchone()
         return row[0] if row else 0
 
-async def get_top_users_by_workouts(limit: int = 3):
-    """Повертає топ користувачів за кількістю тренувань за останній тиждень."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        date_limit = (datetime.now(KYIV_TZ) - timedelta(days=7)).isoformat()
-        query = """
-            SELECT u.user_id, u.username, COUNT(p.id) as workout_count
-            FROM users u JOIN progress p ON u.user_id = p.user_id
-            WHERE p.date >= ? GROUP BY u.user_id ORDER BY workout_count DESC LIMIT ?
-        """
-        cursor = await db.execute(query, (date_limit, limit))
+async def get_weekly_workouts(week: int):
+    """Повертає (user_id, workouts) усіх користувачів, що тренувались протягом тижня week."""
+    async with _read() as db:
+        cursor = await db.execute("SELECT user_id, workouts FROM weekly_workouts WHERE week = ?", (week,))
         return await cursor.fetchall()
 
+async def get_usernames(user_ids: list[int]) -> dict[int, str | None]:
+    """Повертає username для переданих користувачів."""
+    if not user_ids:
+        return {}
+    placeholders = ", ".join("?" * len(user_ids))
+    async with _read() as db:
+        cursor = await db.execute(f"SELECT user_id, username FROM users WHERE user_id IN ({placeholders})", user_ids)
+        return {row['user_id']: row['username'] for row in await cursor.fetchall()}
+
+async def enqueue_messages(messages: list[tuple[int, str, str | None, int]], run_id: str | None = None):
+    """
+    Записує повідомлення (chat_id, text, kwargs_json, next_attempt_ts) в outbox одною транзакцією.
+    Якщо передано run_id, у тій самій транзакції зсуває контрольну точку розсилки.
+    """
+    if not messages:
+        return
+    created_ts = now_epoch()
+    async with _write() as db:
+        await db.executemany(
+            "INSERT INTO outbox (chat_id, text, kwargs, next_attempt_ts, created_ts) VALUES (?, ?, ?, ?, ?)",
+            [(*message, created_ts) for message in messages]
+        )
+        if run_id:
+            await db.execute(
+                "UPDATE broadcast_runs SET last_user_id = ?, enqueued = enqueued + ? WHERE run_id = ?",
+                (messages[-1][0], len(messages), run_id)
+            )
+
+async def get_broadcast_run(run_id: str):
+    """Повертає стан розсилки або None, якщо вона ще не запускалась."""
+    async with _read() as db:
+        cursor = await db.execute("SELECT * FROM broadcast_runs WHERE run_id = ?", (run_id,))
+        return await cursor.fetchone()
+
+async def start_broadcast_run(run_id: str, job: str, started_ts: int):
+    """Реєструє новий запуск розсилки."""
+    async with _write() as db:
+        await db.execute(
+            "INSERT OR IGNORE INTO broadcast_runs (run_id, job, status, started_ts) VALUES (?, ?, 'running', ?)",
+            (run_id, job, started_ts)
+        )
+
+async def finish_broadcast_run(run_id: str):
+    """Позначає розсилку завершеною."""
+    async with _write() as db:
+        await db.execute(
+            "UPDATE broadcast_runs SET status = 'done', finished_ts = ? WHERE run_id = ?", (now_epoch(), run_id)
+        )
+
+async def get_broadcast_windows() -> dict[str, int]:
+    """Повертає налаштовані адміном вікна доставки розсилок (хвилини) за назвою задачі."""
+    async with _read() as db:
+        cursor = await db.execute("SELECT job, window_minutes FROM broadcast_windows")
+        return {row['job']: row['window_minutes'] for row in await cursor.fetchall()}
+
+async def set_broadcast_window(job: str, window_minutes: int):
+    """Зберігає вікно доставки розсилки."""
+    async with _write() as db:
+        await db.execute(
+            "INSERT INTO broadcast_windows (job, window_minutes) VALUES (?, ?) "
+            "ON CONFLICT(job) DO UPDATE SET window_minutes = excluded.window_minutes",
+            (job, window_minutes)
+        )
+
+async def get_interrupted_broadcast_runs(started_after_ts: int):
+    """
+    Повертає незавершені розсилки, розпочаті після started_after_ts.
+    Старіші незавершені розсилки позначає як покинуті.
+    """
+    async with _write() as db:
+        await db.execute(
+            "UPDATE broadcast_runs SET status = 'abandoned' WHERE status = 'running' AND started_ts <= ?",
+            (started_after_ts,)
+        )
+        cursor = await db.execute(
+            "SELECT run_id, job, last_user_id FROM broadcast_runs WHERE status = 'running' ORDER BY started_ts"
+        )
+        return await cursor.fetchall()
+
+async def fetch_due_outbox(limit: int):
+    """
+    Повертає готові до відправки повідомлення - не більше одного, найстарішого, на кожен чат.
+    Повідомлення, відкладене до слоту розсилки, не затримує новіші термінові, а невдале,
+    що чекає повторної спроби (attempts чи last_error), і далі тримає чергу свого чату.
+    """
+    now = now_epoch()
+    async with _read() as db:
+        cursor = await db.execute(
+            """
+            SELECT id, chat_id, text, kwargs, attempts FROM outbox AS o
+            WHERE status = 'pending' AND next_attempt_ts <= ?
+              AND NOT EXISTS (
+                  SELECT 1 FROM outbox AS p
+                  WHERE p.status = 'pending' AND p.chat_id = o.chat_id AND p.id < o.id
+                    AND (p.next_attempt_ts <= ? OR p.attempts > 0 OR p.last_error IS NOT NULL)
+              )
+            ORDER BY next_attempt_ts, id
+            LIMIT ?
+            """,
+            (now, now, limit)
+        )
+        return await cursor.fetchall()
+
+async def complete_outbox(sent: list[int], retry: list[tuple], dead: list[tuple], unreachable: list[int] = ()):
+    """
+    Фіксує результати відправки: надіслані видаляє, retry - (attempts, next_attempt_ts, error, id),
+    dead - (attempts, error, id). Недосяжні чати деактивує разом з рештою їхніх повідомлень.
+    """
+    async with _write() as db:
+        if unreachable:
+            await _deactivate_users(db, unreachable)
+            placeholders = ", ".join("?" * len(unreachable))
+            await db.execute(
+                f"UPDATE outbox SET status = 'dead', last_error = 'unreachable' "
+                f"WHERE status = 'pending' AND chat_id IN ({placeholders})",
+                list(unreachable)
+            )
+        await db.executemany("DELETE FROM outbox WHERE id = ?", [(message_id,) for message_id in sent])
+        await db.executemany(
+            "UPDATE outbox SET attempts = ?, next_attempt_ts = ?, last_error = ? WHERE id = ?", retry
+        )
+        await db.executemany(
+            "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?", dead
+        )
+
+async def get_next_outbox_attempt() -> int | None:
+    """Повертає час найближчої запланованої спроби відправки з outbox."""
+    async with _read() as db:
+        cursor = await db.execute("SELECT MIN(next_attempt_ts) FROM outbox WHERE status = 'pending'")
+        row = await cursor.fetchone()
+        return row[0]
+
 async def set_daily_activity(user_id: int, activity_level: str):
     """Зберігає щоденний рівень активності користувача."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+    async with _write() as db:
         await db.execute("UPDATE users SET daily_activity_level = ? WHERE user_id = ?", (activity_level, user_id))
-        await db.commit()
 
 async def get_daily_activity(user_id: int) -> str | None:
     """Отримує щоденний рівень активності користувача."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cursor = await db.execute("SELECT daily_activity_level FROM users WHERE user_id = ?", (user_id,))
         row = await cursor.fetchone()
         return row['daily_activity_level'] if row else None
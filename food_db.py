@@ -0,0 +1,216 @@
+"""
+Локальна база продуктів і страв (data/foods.csv, КБЖВ на 100 г).
+
+Індекс будується один раз при старті. Назва чи синонім, записані так само,
+як у таблиці, - впевнений збіг. Інші відмінки ("гречки" для "гречка")
+знаходяться через основи слів, але лише якщо й самі слова достатньо схожі:
+основа "вод" однакова у "води" та "водка". Основи, спільні для різних
+продуктів, не використовуються. Решта - нечіткий пошук rapidfuzz по
+заздалегідь підготовленому списку назв. Якщо хоч одну позицію не розпізнано
+впевнено або її кількість не переводиться в грами, опис віддається Gemini.
+Без кількості рахується типова порція страви.
+"""
+import csv
+import os
+import re
+
+from rapidfuzz import fuzz, process
+
+from meal_cache import normalize_description
+
+FOODS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "foods.csv")
+MIN_SCORE = 85  # нижча схожість - звертаємось до Gemini
+STEM_SCORE = 90  # схожість збігу за основою, підтвердженого самими словами
+STEM_AGREEMENT = 70  # мінімальна схожість слів запиту та назви для збігу за основою
+MAX_PIECES = 20  # число без одиниць, більше за це, вважаємо грамами
+MIN_FUZZY_LENGTH = 5  # коротші назви нечітким пошуком не розпізнаються впевнено
+
+# Відмінкові закінчення, які відкидаємо для отримання основи слова (найдовші першими).
+# Суфікси на кшталт "-ка" сюди не входять: "водка" - не форма слова "вода"
+_ENDINGS = sorted((
+    "ями", "ами", "ого", "ому", "ими", "іми", "ові", "еві", "ою", "ею", "ів", "їв", "ей",
+    "ах", "ях", "ом", "ем", "ий", "ій", "их", "іх",
+    "а", "я", "у", "ю", "и", "і", "ї", "о", "е", "є", "ь", "й",
+), key=len, reverse=True)
+_MIN_STEM = 3
+
+# Роздільники позицій: "200г гречки і 2 яйця", "борщ, хліб + сметана"; кома в "1,5 л" не ділить
+_ITEM_SEPARATORS = re.compile(r"(?<!\d),(?!\d)|[;+\n]|\s+(?:і|й|та|плюс)\s+")
+_SIDE_SEPARATORS = re.compile(r"\s+(?:з|із|зі)\s+")
+_UNIT_QUANTITY = re.compile(r"(\d+(?:\.\d+)?) (г|кг|мл|л|шт)\b")
+_BARE_QUANTITY = re.compile(r"^(\d+(?:\.\d+)?) | (\d+(?:\.\d+)?)$")
+_UNIT_GRAMS = {"г": 1, "мл": 1, "кг": 1000, "л": 1000}
+
+_names: dict[str, dict] = {}  # нормалізована назва -> продукт
+_stems: dict[str, list[tuple[str, dict]]] = {}  # основа -> [(назва, продукт)]
+_name_keys: list[str] = []
+_name_foods: list[dict] = []
+
+
+def _stem(word: str) -> str:
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def _stem_key(name: str) -> str:
+    """Ключ пошуку за основами: нормалізована назва з основами слів."""
+    return " ".join(_stem(word) for word in name.split())
+
+
+def load(path: str = FOODS_PATH):
+    """Читає таблицю продуктів і будує індекс пошуку."""
+    names, stems = {}, {}
+    with open(path, encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        food = {
+            "name": row["name"],
+            "calories": float(row["calories"]),
+            "proteins": float(row["proteins"]),
+            "fats": float(row["fats"]),
+            "carbs": float(row["carbs"]),
+            "portion": float(row["portion"]),
+            "piece": float(row["piece"]) if row["piece"] else None,
+        }
+        for alias in [row["name"], *filter(None, row["aliases"].split("|"))]:
+            name = normalize_description(alias)
+            if not name:
+                continue
+            if name in names:
+                if names[name] is not food:
+                    print(f"[FOOD_DB] Назва '{name}' вже належить '{names[name]['name']}', пропускаю для '{food['name']}'")
+                continue
+            names[name] = food
+            stems.setdefault(_stem_key(name), []).append((name, food))
+
+    # Основа, спільна для різних продуктів, не вказує на жоден з них
+    for key, entries in list(stems.items()):
+        foods = {entry[1]['name'] for entry in entries}
+        if len(foods) > 1:
+            print(f"[FOOD_DB] Неоднозначна основа '{key}': {', '.join(sorted(foods))}")
+            del stems[key]
+
+    _names.clear()
+    _names.update(names)
+    _stems.clear()
+    _stems.update(stems)
+    _name_keys[:] = list(names)
+    _name_foods[:] = list(names.values())
+    print(f"[FOOD_DB] Завантажено {len(rows)} продуктів, {len(names)} назв, {len(stems)} основ")
+
+
+def find_food(name: str) -> tuple[dict | None, float]:
+    """Найкращий збіг для назви продукту та його схожість (0-100)."""
+    name = normalize_description(name)
+    if not name:
+        return None, 0
+    if name in _names:
+        return _names[name], 100
+    # Збіг за основою приймаємо, лише якщо самі слова теж схожі
+    for alias, food in _stems.get(_stem_key(name), ()):
+        if fuzz.ratio(name, alias) >= STEM_AGREEMENT:
+            return food, STEM_SCORE
+    match = process.extractOne(name, _name_keys, scorer=fuzz.ratio, processor=None)
+    if not match:
+        return None, 0
+    _, score, index = match
+    if len(name) < MIN_FUZZY_LENGTH:
+        # У короткому слові одна літера - вже інший продукт: "сир" і "сидр"
+        score = min(score, MIN_SCORE - 1)
+    return _name_foods[index], score
+
+
+def parse_items(description: str) -> list[tuple[str, float | None, str | None]]:
+    """
+    Розбиває опис на позиції (назва, кількість, одиниця):
+    "200г гречки і 2 яйця" -> [("гречки", 200, "г"), ("яйця", 2, None)].
+    """
+    items = []
+    for part in _ITEM_SEPARATORS.split(description.lower()):
+        text = normalize_description(part)
+        if not text:
+            continue
+        amount, unit = None, None
+        match = _UNIT_QUANTITY.search(text) or _BARE_QUANTITY.search(text)
+        if match:
+            groups = [group for group in match.groups() if group]
+            amount = float(groups[0])
+            unit = groups[1] if len(groups) > 1 else None
+            text = (text[:match.start()] + " " + text[match.end():]).strip()
+        name = " ".join(text.split())
+        if name:
+            items.append((name, amount, unit))
+    return items
+
+
+def _grams(food: dict, amount: float | None, unit: str | None) -> float | None:
+    """Вага позиції в грамах або None, якщо кількість не вдається перевести в грами."""
+    if unit in _UNIT_GRAMS:
+        return amount * _UNIT_GRAMS[unit]
+    if amount is None:
+        # "пельмені" - типова порція, а не один пельмень
+        return food["portion"]
+    if unit == "шт" or amount <= MAX_PIECES:
+        # "2 пиво" - пляшки чи склянки? Без ваги однієї штуки не вгадуємо
+        return amount * food["piece"] if food["piece"] else None
+    return amount
+
+
+def _match_item(name: str) -> list[tuple[str, dict]] | None:
+    """
+    Пари (частина назви, продукт) для позиції; "вівсянка з бананом"
+    без окремого запису ділиться на частини.
+    """
+    if any(char.isdigit() for char in name):
+        # Число всередині назви ("омлет з 3 яєць") змінює склад страви
+        return None
+    food, score = find_food(name)
+    if score >= MIN_SCORE:
+        return [(name, food)]
+    sides = _SIDE_SEPARATORS.split(name)
+    if len(sides) < 2:
+        return None
+    foods = []
+    for side in sides:
+        food, score = find_food(side)
+        if score < MIN_SCORE:
+            return None
+        foods.append((side, food))
+    return foods
+
+
+def estimate_meal(description: str) -> dict | None:
+    """
+    КБЖВ опису з локальної бази у форматі відповіді Gemini
+    або None, якщо якусь позицію не розпізнано впевнено.
+    """
+    items = parse_items(description)
+    if not items:
+        return None
+    totals = {"calories": 0.0, "proteins": 0.0, "fats": 0.0, "carbs": 0.0}
+    names = []
+    for name, amount, unit in items:
+        foods = _match_item(name)
+        if not foods:
+            return None
+        for i, (part, food) in enumerate(foods):
+            if i == 0 and amount is None and food["portion"] == food["piece"] \
+                    and part != normalize_description(food["name"]):
+                # Порція - одна штука, а "яйця" чи "абрикоси" - невідомо скільки штук
+                return None
+            # Кількість стосується основної страви, гарнір - типова порція
+            grams = _grams(food, amount, unit) if i == 0 else _grams(food, None, None)
+            if grams is None:
+                return None
+            for field in totals:
+                totals[field] += food[field] * grams / 100
+            names.append(f"{food['name'].capitalize()} ({round(grams)} г)")
+    return {
+        "meal_name": ", ".join(names),
+        "calories": round(totals["calories"]),
+        "proteins": round(totals["proteins"], 1),
+        "fats": round(totals["fats"], 1),
+        "carbs": round(totals["carbs"], 1),
+    }
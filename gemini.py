@@ -1,42 +1,90 @@
 import asyncio
 import json
+from typing import Awaitable, Callable
 import google.generativeai as genai
 from config import GEMINI_API_KEY
+import gemini_gateway
 
 genai.configure(api_key=GEMINI_API_KEY)
 model = genai.GenerativeModel('gemini-1.5-flash')
 
-async def _call_gemini(prompt: str, error_message: str, is_json: bool = False) -> str:
+TIMEOUT_MESSAGE = "Вибачте, генерація займає занадто багато часу. Спробуйте, будь ласка, трохи пізніше."
+DAILY_ANALYSIS_ERROR = "Не вдалося згенерувати аналіз."
+MEAL_ANALYSIS_ERROR = "На жаль, не вдалося розпізнати страву."
+
+STREAM_IDLE_TIMEOUT = 30.0  # секунд очікування на наступний фрагмент потокової відповіді
+
+# Викликається з усім текстом, отриманим на цей момент
+OnText = Callable[[str], Awaitable[None]]
+
+def _chunk_text(chunk) -> str:
+    try:
+        return chunk.text
+    except ValueError:
+        # Фрагмент без тексту (наприклад, лише причина завершення)
+        return ""
+
+async def _stream_content(request: Awaitable, on_text: OnText) -> str:
+    """
+    Читає потокову відповідь Gemini, передаючи накопичений текст в on_text.
+    Обмежується час очікування кожного фрагмента, а не всієї генерації.
+    """
+    response = await asyncio.wait_for(request, timeout=STREAM_IDLE_TIMEOUT)
+    chunks = response.__aiter__()
+    text = ""
+    while True:
+        try:
+            chunk = await asyncio.wait_for(chunks.__anext__(), timeout=STREAM_IDLE_TIMEOUT)
+        except StopAsyncIteration:
+            return text
+        piece = _chunk_text(chunk)
+        if piece:
+            text += piece
+            await on_text(text)
+
+async def _generate_text(generative_model, contents, generation_config=None, timeout: float = 60.0) -> str:
+    response = await asyncio.wait_for(
+        generative_model.generate_content_async(contents, generation_config=generation_config),
+        timeout=timeout
+    )
+    return response.text
+
+async def _call_gemini(prompt: str, error_message: str, is_json: bool = False, on_text: OnText | None = None) -> str:
     """
     Універсальна функція для виклику Gemini API з підтримкою JSON-режиму.
+    З on_text відповідь генерується потоком, і частковий текст передається в on_text.
+    Однакові одночасні запити без on_text шлюз об'єднує в один.
     """
     try:
         generation_config = {"response_mime_type": "application/json"} if is_json else None
 
-        response = await asyncio.wait_for(
-            model.generate_content_async(
-                prompt,
-                generation_config=generation_config
-            ),
-            timeout=60.0
-        )
+        if on_text:
+            text = await gemini_gateway.call(lambda: _stream_content(
+                model.generate_content_async(prompt, generation_config=generation_config, stream=True),
+                on_text
+            ))
+        else:
+            text = await gemini_gateway.call(
+                lambda: _generate_text(model, prompt, generation_config),
+                key=(prompt, is_json)
+            )
 
-        if response.text:
-            return response.text
+        if text:
+            return text
         else:
             print("Помилка: Gemini повернув пусту відповідь.")
             return json.dumps({"error": error_message}) if is_json else error_message
 
     except asyncio.TimeoutError:
         print("Помилка: Час очікування відповіді від Gemini API вичерпано.")
-        error_text = "Вибачте, генерація займає занадто багато часу. Спробуйте, будь ласка, трохи пізніше."
+        error_text = TIMEOUT_MESSAGE
         return json.dumps({"error": error_text}) if is_json else error_text
 
     except Exception as e:
         print(f"Помилка генерації в Gemini: {e}")
         return json.dumps({"error": error_message}) if is_json else error_message
 
-async def generate_plan(user_data: dict, today_weekday: str) -> tuple[str, str]:
+async def generate_plan(user_data: dict, today_weekday: str, on_text: OnText | None = None) -> tuple[str, str]:
     prompt = f"""
     Ви - експертний фітнес-тренер та дієтолог. Створи персоналізований фітнес-план для користувача з наступними даними.
     Відповідь має бути чітко структурована у форматі Markdown для Telegram.
@@ -72,7 +120,7 @@ async def generate_plan(user_data: dict, today_weekday: str) -> tuple[str, str]:
     Почніть секцію з унікального маркера `---TODAY_WORKOUT---`. Якщо день відпочинку — вкажіть.
     """
 
-    full_response = await _call_gemini(prompt, "На жаль, виникла помилка при створенні вашого плану.")
+    full_response = await _call_gemini(prompt, "На жаль, виникла помилка при створенні вашого плану.", on_text=on_text)
     
     if "---TODAY_WORKOUT---" in full_response:
         parts = full_response.split("---TODAY_WORKOUT---")
@@ -89,11 +137,52 @@ async def analyze_meal(description: str) -> str:
     "meal_name", "calories", "proteins", "fats", "carbs".
     Опис страви: "{description}"
     """
-    return await _call_gemini(prompt, "На жаль, не вдалося розпізнати страву.", is_json=True)
+    return await _call_gemini(prompt, MEAL_ANALYSIS_ERROR, is_json=True)
+
+async def adjust_fitness_plan(user_data: dict, current_plan: str, rating: int, comment: str,
+                              on_text: OnText | None = None) -> str:
+    """
+    Адаптує фітнес-план користувача на основі відгуку.
+    ПОВЕРТАЄ НОВИЙ ПОВНІСТЮ СФОРМОВАНИЙ ПЛАН.
+    """
+    
+    # Витягуємо ключові дані користувача для більш точної адаптації
+    goal = user_data.get('goal', 'не вказана')
+    conditions = user_data.get('conditions', 'не вказані')
+
+    prompt = f"""
+    Ви - експертний фітнес-тренер. Ваше завдання - переглянути існуючий фітнес-план користувача, 
+    врахувати його відгук і згенерувати **новий, повний і самодостатній план на наступний тиждень.**
+
+    **ДАНІ ПРО КОРИСТУВАЧА:**
+    - Головна ціль: {goal}
+    - Умови для тренувань: {conditions}
+    
+    **ПОПЕРЕДНІЙ ПЛАН:**
+    ---
+    {current_plan}
+    ---
+
+    **ВІДГУК КОРИСТУВАЧА ПРО ПОПЕРЕДНІЙ ПЛАН:**
+    - Оцінка: {rating} з 5
+    - Коментар: "{comment}"
+
+    **ВАШЕ ЗАВДАННЯ:**
+    1.  Проаналізуй оцінку та коментар. Якщо оцінка < 4, зроби план трохи легшим. Якщо оцінка = 5, зроби його трохи складнішим (прогресивне навантаження). Якщо оцінка = 4, залиш складність такою ж, але можеш урізноманітнити вправи. Якщо є конкретні прохання в коментарі, врахуй їх.
+    2.  Згенеруй **повністю новий текст плану на тиждень**. Не використовуй фрази типу "(як у попередньому плані)" або "(без змін)".
+    3.  Кожен тренувальний день у новому плані має містити повний список вправ, підходів та повторень.
+    4.  Почни відповідь з короткого резюме про те, які зміни було внесено. Наприклад: "Чудово, я почув ваш відгук! Я трохи збільшив навантаження на ноги, як ви й просили."
+    5.  Форматуй відповідь у Markdown для гарного відображення в Telegram.
+    """
 
-async def get_ai_chat_response(history: list, new_prompt: str) -> str:
+    error_message = "На жаль, не вдалося адаптувати ваш план. Будь ласка, спробуйте пізніше."
+    
+    # Викликаємо Gemini з оновленим промптом
+    return await _call_gemini(prompt, error_message, on_text=on_text)
+
+async def get_ai_chat_response(history: list, new_prompt: str, on_text: OnText | None = None) -> str:
     """
-    Генерує відповідь у режимі чату на основі історії.
+    Генерує відповідь у режимі чату на основі історії; з on_text - потоком.
     """
     system_instruction = (
         "Ти - досвідчений фітнес-тренер та дієтолог на ім'я AI Fitness Coach. "
@@ -112,8 +201,14 @@ async def get_ai_chat_response(history: list, new_prompt: str) -> str:
     )
 
     try:
-        response = await asyncio.wait_for(chat_model.generate_content_async(formatted_history), timeout=45.0)
-        return response.text
+        if on_text:
+            text = await gemini_gateway.call(lambda: _stream_content(
+                chat_model.generate_content_async(formatted_history, stream=True), on_text
+            ))
+            if text:
+                return text
+            raise ValueError("порожня відповідь")
+        return await gemini_gateway.call(lambda: _generate_text(chat_model, formatted_history, timeout=45.0))
     except Exception as e:
         print(f"Помилка в чаті з Gemini: {e}")
         return "Вибачте, сталася помилка. Спробуйте ще раз або використайте /stop_chat."
@@ -145,14 +240,15 @@ async def get_daily_analysis(summary: dict) -> str:
     """
     prompt = f"""
     Зроби короткий аналіз на основі щоденного звіту:
-    - Калорії спожито: {summary.get("calories_eaten")}
-    - Калорії спалено: {summary.get("calories_burned")}
+    - Калорії спожито: {summary.get("consumed_calories")}
+    - Рекомендована норма: {summary.get("target_calories")}
+    - Калорії спалено: {summary.get("burned_calories")}
     - Ціль: {summary.get("goal")}
-    - Прогрес: {summary.get("progress_notes")}
+    - Рівень активності сьогодні: {summary.get("activity_level")}
 
     Виведи рекомендації на завтра у 3-4 реченнях.
     """
-    return await _call_gemini(prompt, "Не вдалося згенерувати аналіз.")
+    return await _call_gemini(prompt, DAILY_ANALYSIS_ERROR)
 
 
 async def generate_fitness_tip() -> str:
@@ -193,45 +289,3 @@ async def generate_recipe_from_products(products: str, user_data: dict) -> str:
     
     error_message = "Вибачте, не вдалося придумати рецепт з цих продуктів. Спробуйте інший набір."
     return await _call_gemini(prompt, error_message)
-
-
-
-async def adjust_fitness_plan(user_data: dict, current_plan: str, rating: int, comment: str) -> str:
-    """
-    Адаптує фітнес-план користувача на основі відгуку.
-    ПОВЕРТАЄ НОВИЙ ПОВНІСТЮ СФОРМОВАНИЙ ПЛАН.
-    """
-    
-    # Витягуємо ключові дані користувача для більш точної адаптації
-    goal = user_data.get('goal', 'не вказана')
-    conditions = user_data.get('conditions', 'не вказані')
-
-    prompt = f"""
-    Ви - експертний фітнес-тренер. Ваше завдання - переглянути існуючий фітнес-план користувача, 
-    врахувати його відгук і згенерувати **новий, повний і самодостатній план на наступний тиждень.**
-
-    **ДАНІ ПРО КОРИСТУВАЧА:**
-    - Головна ціль: {goal}
-    - Умови для тренувань: {conditions}
-    
-    **ПОПЕРЕДНІЙ ПЛАН:**
-    ---
-    {current_plan}
-    ---
-
-    **ВІДГУК КОРИСТУВАЧА ПРО ПОПЕРЕДНІЙ ПЛАН:**
-    - Оцінка: {rating} з 5
-    - Коментар: "{comment}"
-
-    **ВАШЕ ЗАВДАННЯ:**
-    1.  Проаналізуй оцінку та коментар. Якщо оцінка < 4, зроби план трохи легшим. Якщо оцінка = 5, зроби його трохи складнішим (прогресивне навантаження). Якщо оцінка = 4, залиш складність такою ж, але можеш урізноманітнити вправи. Якщо є конкретні прохання в коментарі, врахуй їх.
-    2.  Згенеруй **повністю новий текст плану на тиждень**. Не використовуй фрази типу "(як у попередньому плані)" або "(без змін)".
-    3.  Кожен тренувальний день у новому плані має містити повний список вправ, підходів та повторень.
-    4.  Почни відповідь з короткого резюме про те, які зміни було внесено. Наприклад: "Чудово, я почув ваш відгук! Я трохи збільшив навантаження на ноги, як ви й просили."
-    5.  Форматуй відповідь у Markdown для гарного відображення в Telegram.
-    """
-
-    error_message = "На жаль, не вдалося адаптувати ваш план. Будь ласка, спробуйте пізніше."
-    
-    # Викликаємо Gemini з оновленим промптом
-    return await _call_gemini(prompt, error_message)
\ No newline at end of file
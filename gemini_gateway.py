@@ -0,0 +1,109 @@
+"""
+Єдиний шлюз до Gemini API.
+
+Однакові запити, що виконуються одночасно, об'єднуються в один (single-flight):
+усі очікувачі отримують результат першого. Одночасно виконується не більше
+GEMINI_CONCURRENCY запитів, а частоту обмежує маркерне відро на GEMINI_RPM
+запитів за хвилину. Для кожного запиту рахується окремо час очікування в черзі
+та час виконання.
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Hashable
+
+from google.api_core.exceptions import ResourceExhausted
+
+from utils.broadcast import TokenBucket
+
+GEMINI_CONCURRENCY = 8
+GEMINI_RPM = 60
+GEMINI_BURST = 10  # скільки запитів можна виконати одразу після простою
+QUOTA_PAUSE = 30  # секунд паузи для всіх запитів після відповіді 429
+
+_semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
+rate_limiter = TokenBucket(GEMINI_RPM / 60, GEMINI_BURST)
+_in_flight: dict[Hashable, asyncio.Future] = {}
+
+
+@dataclass
+class GatewayStats:
+    requests: int = 0
+    coalesced: int = 0
+    errors: int = 0
+    quota_errors: int = 0
+    queue_wait: float = 0.0
+    service_time: float = 0.0
+    max_queue_wait: float = 0.0
+    max_service_time: float = 0.0
+
+    @property
+    def avg_queue_wait(self) -> float:
+        return self.queue_wait / self.requests if self.requests else 0.0
+
+    @property
+    def avg_service_time(self) -> float:
+        return self.service_time / self.requests if self.requests else 0.0
+
+    def __str__(self):
+        return (
+            f"[GEMINI] запитів {self.requests}, об'єднано {self.coalesced}, помилок {self.errors} "
+            f"(квота {self.quota_errors}); черга {self.avg_queue_wait:.2f} с (макс. {self.max_queue_wait:.2f}), "
+            f"виконання {self.avg_service_time:.2f} с (макс. {self.max_service_time:.2f})"
+        )
+
+
+stats = GatewayStats()
+
+
+async def _run(request: Callable[[], Awaitable]):
+    queued = time.monotonic()
+    async with _semaphore:
+        await rate_limiter.acquire()
+        started = time.monotonic()
+        wait = started - queued
+        stats.queue_wait += wait
+        stats.max_queue_wait = max(stats.max_queue_wait, wait)
+        try:
+            return await request()
+        except ResourceExhausted:
+            # Квоту вичерпано - пригальмовуємо всі наступні запити
+            stats.errors += 1
+            stats.quota_errors += 1
+            rate_limiter.pause(QUOTA_PAUSE)
+            print(f"[GEMINI] Квоту вичерпано, пауза {QUOTA_PAUSE} с")
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            service = time.monotonic() - started
+            stats.requests += 1
+            stats.service_time += service
+            stats.max_service_time = max(stats.max_service_time, service)
+
+
+def _forget(key: Hashable, task: asyncio.Future):
+    _in_flight.pop(key, None)
+    # Позначаємо помилку отриманою, навіть якщо всі очікувачі вже скасовані
+    if not task.cancelled():
+        task.exception()
+
+
+async def call(request: Callable[[], Awaitable], key: Hashable = None):
+    """
+    Виконує request() під загальними лімітами. Якщо запит з таким самим key
+    вже виконується, чекає на його результат замість нового виклику.
+    Без key (чат, потокові відповіді) запити не об'єднуються.
+    """
+    if key is None:
+        return await _run(request)
+    task = _in_flight.get(key)
+    if task is not None:
+        stats.coalesced += 1
+    else:
+        task = asyncio.ensure_future(_run(request))
+        _in_flight[key] = task
+        task.add_done_callback(lambda done: _forget(key, done))
+    # Скасування одного з очікувачів не скасовує спільний запит
+    return await asyncio.shield(task)
@@ -4,6 +4,7 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 import database as db
 import achievements
+from leaderboard import leaderboard
 import keyboards as kb
 from config import ADMIN_ID, PAYMENT_CARD_NUMBER
 from utils.safe_sender import answer_message_safely, send_message_safely
@@ -21,7 +22,8 @@ async def cmd_help(message: Message):
         "/start - Розпочати роботу або оновити дані\n"
         "/myplan - Переглянути ваш поточний план\n"
         "/progress - Ваша статистика тренувань\n"
-        "/achievements - Мої досягнення\n\n"
+        "/achievements - Мої досягнення\n"
+        "/leaderboard - Лідерборд тижня\n\n"
         "**Спільнота та Челенджі (тільки в приватних повідомленнях):**\n"
         "/challenges - Переглянути та приєднатись до викликів\n"
         "/create_challenge - Створити публічний виклик\n"
@@ -40,6 +42,10 @@ async def cmd_help(message: Message):
         help_text += "\n\n**Адмін-команди:**\n/grant <user_id> - Надати довічний доступ\n\n"
         help_text += "/delete_challenge id - Видалити челендж (адмін)\n\n"
         help_text += "/check_jobs - Покаже вам список усіх завдань (адмін)\n\n"
+        help_text += "/pruned - Кількість деактивованих користувачів (адмін)\n\n"
+        help_text += "/set_window - Вікна доставки розсилок (адмін)\n\n"
+        help_text += "/cache_stats - Статистика кешу аналізу страв (адмін)\n\n"
+        help_text += "/gemini_stats - Навантаження на Gemini (адмін)\n\n"
     await answer_message_safely(message, help_text)
 
 @router.message(
@@ -95,7 +101,8 @@ async def cmd_achievements(message: Message):
 @router.callback_query(F.data == "workout_done")
 async def process_workout_done(callback: CallbackQuery, bot: Bot):
     user_id = callback.from_user.id
-    await db.log_workout_completion(user_id)
+    week_workouts = await db.log_workout_completion(user_id)
+    leaderboard.update(user_id, week_workouts)
     await achievements.check_workout_achievements(user_id, bot)
     await callback.message.edit_text("✅ Чудова робота! Тренування зараховано.")
     await callback.answer()
@@ -153,6 +160,7 @@ async def admin_confirm_payment(callback: CallbackQuery, bot: Bot):
     target_user_id = int(callback.data.split(":")[1])
     await db.update_user_subscription(target_user_id, months=1)
     await db.delete_pending_payment(target_user_id)
+    db.invalidate_subscription_cache(target_user_id)
     receipt_text = (f"🧾 **Квитанція про оплату**\n\n**Послуга:** Підписка на AI Fitness Coach (1 місяць)\n**Сума:** 49.00 грн\n**Дата:** {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\nДякуємо, що ви з нами!")
     try:
         await send_message_safely(bot, target_user_id, "✅ Вашу оплату підтверджено! Підписку активовано на 1 місяць.")
@@ -165,6 +173,7 @@ async def admin_confirm_payment(callback: CallbackQuery, bot: Bot):
 async def admin_reject_payment(callback: CallbackQuery, bot: Bot):
     target_user_id = int(callback.data.split(":")[1])
     await db.delete_pending_payment(target_user_id)
+    db.invalidate_subscription_cache(target_user_id)
     try:
         await send_message_safely(bot, target_user_id, "❌ На жаль, ваш платіж не було знайдено.")
         await callback.message.edit_text(f"❌ Запит на оплату для користувача {target_user_id} відхилено.")
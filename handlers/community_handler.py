@@ -6,13 +6,11 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from datetime import datetime, timedelta
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 # Локальні імпорти
 import database as db
 import keyboards as kb
-from utils.safe_sender import send_message_safely
+import outbox
 from config import GROUP_ID
 import achievements
 
@@ -138,8 +136,8 @@ async def process_challenge_description(message: Message, state: FSMContext):
     await state.set_state(CommunityStates.creating_challenge_duration)
 
 @router.message(CommunityStates.creating_challenge_duration, F.chat.type == "private")
-async def process_challenge_duration(message: Message, state: FSMContext, bot: Bot, scheduler: AsyncIOScheduler):
-    """Завершує створення челенджу і планує його автоматичне видалення."""
+async def process_challenge_duration(message: Message, state: FSMContext, bot: Bot):
+    """Завершує створення челенджу; після завершення терміну його видалить періодичне очищення."""
     try:
         duration = int(message.text)
         if not (1 <= duration <= 100):
@@ -155,17 +153,7 @@ async def process_challenge_duration(message: Message, state: FSMContext, bot: B
         message.from_user.id, data['title'], data['description'], duration
     )
     
-    run_date = datetime.now() + timedelta(days=duration)
-    
-    scheduler.add_job(
-        db.delete_challenge, 
-        trigger='date', 
-        run_date=run_date, 
-        args=[challenge_id],
-        id=f"delete_challenge_{challenge_id}",
-        replace_existing=True
-    )
-    print(f"✅ Заплановано видалення для челенджу ID: {challenge_id} на {run_date.strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"✅ Створено челендж ID: {challenge_id} на {duration} днів")
     
     await message.answer(
         f"✅ Ваш челендж успішно створено! Він буде активний {duration} днів."
@@ -180,7 +168,7 @@ async def process_challenge_duration(message: Message, state: FSMContext, bot: B
         f"<i>Приєднуйтесь до виклику в особистих повідомленнях з ботом через команду /challenges!</i>"
     )
     if GROUP_ID:
-        await send_message_safely(bot, int(GROUP_ID), group_message, parse_mode="HTML")
+        await outbox.enqueue(int(GROUP_ID), group_message, parse_mode="HTML")
 
 # --- Створення дуелі ---
 
@@ -220,8 +208,8 @@ async def send_duel_invitation(bot: Bot, initiator_id: int, opponent_id: int, op
     builder.button(text="✅ Прийняти", callback_data=f"duel_accept:{duel_id}")
     builder.button(text="❌ Відхилити", callback_data=f"duel_reject:{duel_id}")
 
-    await send_message_safely(
-        bot, opponent_id,
+    await outbox.enqueue(
+        opponent_id,
         f"🤺 **Вас викликали на дуель!**\n\n"
         f"{initiator_name} кидає вам виклик:\n*«{description}»*\n\nПриймаєте?",
         reply_markup=builder.as_markup(),
@@ -254,7 +242,7 @@ async def accept_duel(callback: CallbackQuery, bot: Bot):
     action_kb = kb.get_duel_action_kb(duel_id)
     
     await callback.message.edit_text(duel_message, reply_markup=action_kb)
-    await send_message_safely(bot, initiator_id, f"✅ Ваш суперник прийняв виклик! Дуель «{description}» розпочато.", reply_markup=action_kb)
+    await outbox.enqueue(initiator_id, f"✅ Ваш суперник прийняв виклик! Дуель «{description}» розпочато.", reply_markup=action_kb)
 
     if GROUP_ID:
         try:
@@ -269,7 +257,7 @@ async def accept_duel(callback: CallbackQuery, bot: Bot):
                 f"<b>Умова:</b> <i>«{description}»</i>\n\n"
                 f"Слідкуємо за результатами! 🍿"
             )
-            await send_message_safely(bot, int(GROUP_ID), group_message, parse_mode="HTML")
+            await outbox.enqueue(int(GROUP_ID), group_message, parse_mode="HTML")
         except Exception as e:
             print(f"Помилка публікації дуелі в групу: {e}")
 
@@ -372,7 +360,7 @@ async def process_video_confirmation(message: Message, state: FSMContext, bot: B
                     f"<i>«{description}»</i>\n\n"
                     f"Перегляньте їхні відео вище та пишіть в коментарях, хто, на вашу думку, був кращим! 👇"
                 )
-                await send_message_safely(bot, int(GROUP_ID), final_post_text, parse_mode="HTML")
+                await outbox.enqueue(int(GROUP_ID), final_post_text, parse_mode="HTML")
 
             else:
                 # Це було перше відео
@@ -393,7 +381,7 @@ async def process_video_confirmation(message: Message, state: FSMContext, bot: B
 
 # --- Адмін-команди ---
 @router.message(Command("delete_challenge"), F.chat.type == "private")
-async def delete_challenge_command(message: Message, scheduler: AsyncIOScheduler):
+async def delete_challenge_command(message: Message):
     """Команда для адміністратора для ручного видалення челенджу."""
     if not await db.is_admin(message.from_user.id):
         await message.answer("Ця команда доступна лише адміністратору.")
@@ -405,15 +393,6 @@ async def delete_challenge_command(message: Message, scheduler: AsyncIOScheduler
         return
         
     challenge_id = int(args[1])
-    
-    job_id = f"delete_challenge_{challenge_id}"
-    if scheduler.get_job(job_id):
-        try:
-            scheduler.remove_job(job_id)
-            print(f"Заплановане видалення для челенджу {challenge_id} скасовано.")
-        except Exception as e:
-            print(f"Помилка скасування завдання {job_id}: {e}")
-
     await db.delete_challenge(challenge_id)
     await message.answer(f"Челендж з ID {challenge_id} та пов'язані з ним дані видалено.")
 
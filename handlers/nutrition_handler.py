@@ -1,14 +1,17 @@
 from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import database as db
 import keyboards as kb
 from utils.safe_sender import answer_message_safely, send_message_safely
 import gemini
+import meal_cache
+import food_db
+import asyncio
 import json
-from rapidfuzz import process
+from cachetools import TTLCache
 
 router = Router()
 
@@ -16,43 +19,83 @@ class NutritionStates(StatesGroup):
     waiting_for_meal_description = State()
     waiting_for_meal_confirmation = State()
 
-FOOD_DICT = {
-    "борщ": {"calories": 80, "proteins": 2, "fats": 3, "carbs": 10},
-    "каша з м'ясом": {"calories": 150, "proteins": 7, "fats": 5, "carbs": 20},
-    # ...інші страви...
-}
+QUICK_MEALS_LIMIT = 6  # кнопок швидкого запису під запитанням "що ви з'їли?"
+MEAL_PROMPT = "Чудово! Що саме ви з'їли? Опишіть страву якомога детальніше."
 
-def get_local_calories(description):
-    match, score, _ = process.extractOne(description, FOOD_DICT.keys())
-    if score > 80:
-        return FOOD_DICT[match]
-    return None
+async def log_saved_meal(user_id: int, meal):
+    """Повторно записує збережену страву з її КБЖВ - без Gemini і підтвердження."""
+    await db.log_meal(
+        user_id=user_id,
+        description=meal['description'],
+        calories=meal['calories'],
+        proteins=meal['proteins'],
+        fats=meal['fats'],
+        carbs=meal['carbs']
+    )
+    return f"✅ Записано: {meal['description']} ({meal['calories']} ккал)"
 
 # Обробка ручного додавання та з нагадувань
 @router.message(F.chat.type == "private", F.text == "🥑 Додати їжу")
-@router.message(Command("add_meal"), F.chat.type == "private")
 @router.callback_query(F.data.startswith("log_meal:"))
 async def start_meal_logging(event: Message | CallbackQuery, state: FSMContext):
     message = event if isinstance(event, Message) else event.message
-    await answer_message_safely(message, "Чудово! Що саме ви з'їли? Опишіть страву якомога детальніше.")
+    meals = await db.get_frequent_meals(event.from_user.id, QUICK_MEALS_LIMIT)
+    if meals:
+        await answer_message_safely(
+            message, MEAL_PROMPT + "\n\nАбо оберіть одну з ваших частих страв:",
+            reply_markup=kb.get_frequent_meals_kb(meals)
+        )
+    else:
+        await answer_message_safely(message, MEAL_PROMPT)
     await state.set_state(NutritionStates.waiting_for_meal_description)
     if isinstance(event, CallbackQuery):
         await event.answer()
 
+@router.message(Command("add_meal"), F.chat.type == "private")
+async def cmd_add_meal(message: Message, state: FSMContext, bot: Bot, command: CommandObject):
+    """
+    /add_meal - меню запису; /add_meal <страва> - одразу записує збережену страву з точно таким
+    описом, пропонує кнопками збережені страви, що з нього починаються, або аналізує нову.
+    """
+    if not command.args:
+        await start_meal_logging(message, state)
+        return
+    meal = await db.find_frequent_meal(message.from_user.id, command.args)
+    if meal:
+        await state.clear()
+        await message.answer(await log_saved_meal(message.from_user.id, meal))
+        return
+    meals = await db.search_frequent_meals(message.from_user.id, command.args, QUICK_MEALS_LIMIT)
+    if meals:
+        await answer_message_safely(
+            message, "Оберіть одну з ваших збережених страв або опишіть, що саме ви з'їли:",
+            reply_markup=kb.get_frequent_meals_kb(meals)
+        )
+        await state.set_state(NutritionStates.waiting_for_meal_description)
+        return
+    await analyze_meal_description(message, state, bot, command.args)
+
+@router.callback_query(F.data.startswith("quick_meal:"))
+async def quick_log_meal(callback: CallbackQuery, state: FSMContext):
+    meal = await db.get_frequent_meal(callback.from_user.id, int(callback.data.split(":")[1]))
+    if not meal:
+        await callback.answer("Цієї страви вже немає серед частих. Опишіть її текстом.", show_alert=True)
+        return
+    await state.clear()
+    await callback.message.edit_text(await log_saved_meal(callback.from_user.id, meal))
+    await callback.answer()
+
 @router.message(NutritionStates.waiting_for_meal_description, F.chat.type == "private")
 async def process_meal_description(message: Message, state: FSMContext, bot: Bot):
-    await bot.send_chat_action(chat_id=message.chat.id, action="typing")
-    response_json_str = await gemini.analyze_meal(message.text)
+    await analyze_meal_description(message, state, bot, message.text)
+
+async def analyze_meal_description(message: Message, state: FSMContext, bot: Bot, description: str):
     try:
-        meal_data = json.loads(response_json_str)
-        # Якщо Gemini не визначив калорійність, шукаємо у локальному словнику
-        if not meal_data.get('calories') or meal_data['calories'] in [0, "невідомо", None]:
-            local = get_local_calories(message.text)
-            if local:
-                meal_data['calories'] = local['calories']
-                meal_data['proteins'] = local['proteins']
-                meal_data['fats'] = local['fats']
-                meal_data['carbs'] = local['carbs']
+        # Спершу локальна база; Gemini - лише коли якусь позицію не розпізнано впевнено
+        meal_data = food_db.estimate_meal(description)
+        if meal_data is None:
+            await bot.send_chat_action(chat_id=message.chat.id, action="typing")
+            meal_data = await meal_cache.analyze_meal(description)
         await state.update_data(meal_data=meal_data)
         confirmation_text = (
             f"Я розпізнав вашу страву як **'{meal_data['meal_name']}'**.\n\n"
@@ -104,49 +147,65 @@ async def show_calories_report_callback_from_tools(callback: CallbackQuery, bot:
     await send_daily_summary(callback.from_user.id, bot)
     await callback.answer()
 
+# Тут логіка отримання спалених калорій та цілі
+# Для прикладу, використаємо заглушки
+BURNED_CALORIES = 300 # Потрібно буде парсити з плану
+TARGET_CALORIES = 2200 # Потрібно буде брати з даних користувача
+NO_MEALS_TEXT = "Сьогодні ви ще не додавали інформацію про їжу."
+
+# Аналіз Gemini залежить лише від цілі, діапазону калорій і активності,
+# тому однакові набори вхідних даних обслуговуються з кешу
+CALORIE_BAND = 200
+ANALYSIS_CONCURRENCY = 5
+_analysis_cache = TTLCache(maxsize=1024, ttl=6 * 3600)
+_analysis_semaphore = asyncio.Semaphore(ANALYSIS_CONCURRENCY)
+
+def build_daily_report(totals) -> str:
+    """Текст денного звіту з підсумків daily_nutrition."""
+    report_lines = [
+        "**Ваш раціон за сьогодні:**\n",
+        f"🍽 Прийомів їжі: {totals['meals']}",
+        f"(Б: {round(totals['proteins'])}г, Ж: {round(totals['fats'])}г, В: {round(totals['carbs'])}г)",
+        "\n---",
+        f"**🔥 Всього спожито: {totals['calories']} ккал**",
+        f"*Рекомендована норма: ~{TARGET_CALORIES} ккал*",
+    ]
+    return "\n".join(report_lines)
+
+def daily_analysis_key(goal: str | None, calories: int, activity_level: str | None) -> tuple:
+    return goal or "не вказана", calories // CALORIE_BAND, activity_level
+
+async def get_daily_analysis(key: tuple) -> str:
+    """Аналіз дня від Gemini для ключа daily_analysis_key з кешем і обмеженням паралельних запитів."""
+    if key in _analysis_cache:
+        return _analysis_cache[key]
+    async with _analysis_semaphore:
+        # Поки чекали, такий самий аналіз міг з'явитись у кеші
+        if key in _analysis_cache:
+            return _analysis_cache[key]
+        goal, band, activity_level = key
+        analysis_text = await gemini.get_daily_analysis({
+            "goal": goal,
+            "consumed_calories": f"{band * CALORIE_BAND}-{(band + 1) * CALORIE_BAND} ккал",
+            "target_calories": TARGET_CALORIES,
+            "burned_calories": BURNED_CALORIES,
+            "activity_level": activity_level or "не вказано",
+        })
+    if analysis_text not in (gemini.DAILY_ANALYSIS_ERROR, gemini.TIMEOUT_MESSAGE):
+        _analysis_cache[key] = analysis_text
+    return analysis_text
+
 async def send_daily_summary(user_id: int, bot: Bot):
-    summary_data = await db.get_daily_food_summary(user_id)
-    if not summary_data:
-        await send_message_safely(bot, user_id, "Сьогодні ви ще не додавали інформацію про їжу.")
+    totals = await db.get_daily_nutrition(user_id)
+    if not totals:
+        await send_message_safely(bot, user_id, NO_MEALS_TEXT)
         return
 
-    report_lines = ["**Ваш раціон за сьогодні:**\n"]
-    total_calories = 0
-    
-    for meal in summary_data:
-        report_lines.append(f"- {meal[0]}: {meal[1]} ккал")
-        try:
-            val = meal[1]
-            if isinstance(val, str) and "-" in val:
-                parts = val.replace("ккал", "").split("-")
-                nums = [int(p.strip()) for p in parts if p.strip().isdigit()]
-                if nums:
-                    avg = sum(nums) // len(nums)
-                    total_calories += avg
-            else:
-                total_calories += int(val)
-        except (ValueError, TypeError):
-            total_calories += 0
-    
-    # Тут логіка отримання спалених калорій та цілі
-    # Для прикладу, використаємо заглушки
-    burned_calories = 300 # Потрібно буде парсити з плану
-    target_calories = 2200 # Потрібно буде брати з даних користувача
-    activity_level = await db.get_daily_activity(user_id)
-    
-    report_lines.append(f"\n---")
-    report_lines.append(f"**🔥 Всього спожито: {total_calories} ккал**")
-    report_lines.append(f"*Рекомендована норма: ~{target_calories} ккал*")
-
-    await send_message_safely(bot, user_id, "\n".join(report_lines))
+    await send_message_safely(bot, user_id, build_daily_report(totals))
 
     # Запит до Gemini для фінального аналізу
-    analysis_data = {
-        "goal": "Набрати масу", # Потрібно брати з даних користувача
-        "consumed_calories": total_calories,
-        "target_calories": target_calories,
-        "burned_calories": burned_calories,
-        "activity_level": activity_level
-    }
-    analysis_text = await gemini.get_daily_analysis(analysis_data)
+    onboarding_data = await db.get_user_onboarding_data(user_id) or {}
+    activity_level = await db.get_daily_activity(user_id)
+    key = daily_analysis_key(onboarding_data.get('goal'), totals['calories'], activity_level)
+    analysis_text = await get_daily_analysis(key)
     await send_message_safely(bot, user_id, analysis_text)
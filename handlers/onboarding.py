@@ -7,7 +7,7 @@ import keyboards as kb
 import gemini
 import database as db
 import achievements
-from utils.safe_sender import answer_message_safely
+from utils.safe_sender import ProgressiveMessage, answer_message_safely
 from config import GROUP_INVITE_LINK
 import locale
 from datetime import datetime
@@ -111,11 +111,16 @@ async def process_food_prefs_and_generate(message: Message, state: FSMContext, b
     await message.answer("Супер! Всі дані зібрано. Готую вашу персональну програму...", reply_markup=ReplyKeyboardRemove())
     
     today_weekday = datetime.now().strftime('%A').capitalize()
-    full_plan, today_workout = await gemini.generate_plan(user_data, today_weekday)
+    progress = ProgressiveMessage(message, "⏳ Пишу план...")
+    await progress.start()
+    # Під час генерації показуємо лише сам план, без секції тренування на сьогодні
+    full_plan, today_workout = await gemini.generate_plan(
+        user_data, today_weekday, on_text=lambda text: progress.update(text.split("---TODAY_WORKOUT---")[0])
+    )
     
     await db.save_fitness_plan(user_id, full_plan)
     
-    await answer_message_safely(message, full_plan)
+    await progress.finish(full_plan)
     
     if "На жаль, виникла помилка" not in full_plan and "Вибачте, генерація" not in full_plan:
         await message.answer("Ваш план збережено! Ви можете переглянути його в будь-який час.", reply_markup=kb.main_menu_kb)
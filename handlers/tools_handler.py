@@ -6,7 +6,7 @@ from aiogram.fsm.state import State, StatesGroup
 import keyboards as kb
 import gemini
 import database as db
-from utils.safe_sender import answer_message_safely, send_message_safely
+from utils.safe_sender import ProgressiveMessage, answer_message_safely, send_message_safely
 from .common import cmd_help
 from config import GROUP_ID
 import re
@@ -165,13 +165,14 @@ async def handle_ai_chat(message: Message, state: FSMContext, bot: Bot):
     data = await state.get_data()
     history = data.get('history', [])
     
-    response_text = await gemini.get_ai_chat_response(history, message.text)
+    progress = ProgressiveMessage(message)
+    await progress.start()
+    response_text = await gemini.get_ai_chat_response(history, message.text, on_text=progress.update)
+    await progress.finish(response_text)
     
     history.append({"author": "user", "text": message.text})
     history.append({"author": "model", "text": response_text})
     await state.update_data(history=history[-4:]) # Keep last 4 turns
-    
-    await answer_message_safely(message, response_text)
 
 # --- Обробка "Поділитися результатом" ---
 @router.callback_query(F.data == "share_result")
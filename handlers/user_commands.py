@@ -5,10 +5,13 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import database as db
 import gemini
+import gemini_gateway
+import meal_cache
 import achievements
 import keyboards as kb
-from utils.safe_sender import answer_message_safely
-from scheduler import send_today_workout_for_user
+from leaderboard import leaderboard
+from utils.safe_sender import ProgressiveMessage, answer_message_safely
+from scheduler import DELIVERY_WINDOWS, send_today_workout_for_user
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 
@@ -38,6 +41,93 @@ async def check_scheduled_jobs(message: Message, scheduler: AsyncIOScheduler):
         
     await message.answer(response_text)
 
+
+@router.message(Command("pruned"), F.chat.type == "private")
+async def cmd_pruned_users(message: Message):
+    """
+    Команда для адміна: скільки користувачів виключено з розсилок як недосяжних.
+    """
+    if not await db.is_admin(message.from_user.id):
+        return
+
+    week_ago = db.now_epoch() - 7 * 86400
+    total = await db.count_deactivated_users()
+    last_week = await db.count_deactivated_users(week_ago)
+    await message.answer(
+        f"🚫 Деактивовано користувачів (заблокували бота або видалили акаунт): <b>{total}</b>\n"
+        f"З них за останні 7 днів: <b>{last_week}</b>",
+        parse_mode="HTML"
+    )
+
+
+@router.message(Command("cache_stats"), F.chat.type == "private")
+async def cmd_cache_stats(message: Message):
+    """
+    Команда для адміна: статистика кешу аналізу страв.
+    """
+    if not await db.is_admin(message.from_user.id):
+        return
+
+    stats = meal_cache.stats
+    await message.answer(
+        f"🍽 <b>Кеш аналізу страв</b>\n\n"
+        f"З пам'яті: <b>{stats['memory_hits']}</b>\n"
+        f"З бази: <b>{stats['db_hits']}</b>\n"
+        f"Запитів до Gemini: <b>{stats['misses']}</b>\n"
+        f"Влучання: <b>{meal_cache.hit_rate():.0%}</b>",
+        parse_mode="HTML"
+    )
+
+
+@router.message(Command("gemini_stats"), F.chat.type == "private")
+async def cmd_gemini_stats(message: Message):
+    """
+    Команда для адміна: навантаження на Gemini - об'єднані запити, час у черзі та час виконання.
+    """
+    if not await db.is_admin(message.from_user.id):
+        return
+
+    stats = gemini_gateway.stats
+    await message.answer(
+        f"🤖 <b>Запити до Gemini</b>\n\n"
+        f"Виконано: <b>{stats.requests}</b> (помилок {stats.errors}, з них квота {stats.quota_errors})\n"
+        f"Об'єднано з однаковими: <b>{stats.coalesced}</b>\n"
+        f"Очікування в черзі: <b>{stats.avg_queue_wait:.2f} с</b> (макс. {stats.max_queue_wait:.2f} с)\n"
+        f"Виконання: <b>{stats.avg_service_time:.2f} с</b> (макс. {stats.max_service_time:.2f} с)",
+        parse_mode="HTML"
+    )
+
+
+@router.message(Command("set_window"), F.chat.type == "private")
+async def cmd_set_delivery_window(message: Message):
+    """
+    Команда для адміна: /set_window <задача> <хвилини> задає вікно, по якому
+    розподіляється розсилка; без аргументів показує поточні вікна.
+    """
+    if not await db.is_admin(message.from_user.id):
+        return
+
+    args = message.text.split()
+    if len(args) == 1:
+        overrides = await db.get_broadcast_windows()
+        lines = [
+            f"🔹 <code>{job}</code>: {overrides.get(job, default)} хв"
+            for job, default in DELIVERY_WINDOWS.items()
+        ]
+        await message.answer(
+            "<b>Вікна доставки розсилок:</b>\n\n" + "\n".join(lines) +
+            "\n\nЗмінити: /set_window &lt;задача&gt; &lt;хвилини&gt;",
+            parse_mode="HTML"
+        )
+        return
+
+    if len(args) != 3 or args[1] not in DELIVERY_WINDOWS or not args[2].isdigit() or int(args[2]) > 180:
+        await message.answer("Використання: /set_window <задача> <хвилини від 0 до 180>")
+        return
+
+    await db.set_broadcast_window(args[1], int(args[2]))
+    await message.answer(f"✅ Розсилка {args[1]} тепер розподіляється на {int(args[2])} хв.")
+
 class UserActionStates(StatesGroup):
     waiting_for_products = State()
     waiting_for_feedback_comment = State()
@@ -45,8 +135,9 @@ class UserActionStates(StatesGroup):
 @router.message(Command("progress"))
 async def cmd_progress(message: Message):
     user_id = message.from_user.id
-    total_workouts = await db.count_total_workouts(user_id)
-    last_7_days = await db.count_workouts_last_n_days(user_id, 7)
+    stats = await db.get_workout_stats(user_id)
+    total_workouts = stats['total'] if stats else 0
+    last_7_days = db.count_recent_workouts(stats, 7)
     text = (
         f"📊 **Ваш прогрес:**\n\n"
         f"🔹 **Всього виконано тренувань:** {total_workouts}\n"
@@ -54,6 +145,26 @@ async def cmd_progress(message: Message):
         f"Продовжуйте в тому ж дусі!"
     )
     await answer_message_safely(message, text)
+@router.message(Command("leaderboard"))
+async def cmd_leaderboard(message: Message):
+    top_users = leaderboard.top(10)
+    if not top_users:
+        await message.answer("Цього тижня ще ніхто не відмітив тренування. Будьте першим! 💪")
+        return
+    usernames = await db.get_usernames([user_id for user_id, _ in top_users])
+    lines = ["🏆 **Лідерборд цього тижня:**\n"]
+    for place, (user_id, workout_count) in enumerate(top_users, start=1):
+        username = usernames.get(user_id)
+        display_name = f"@{username}" if username else f"User {user_id}"
+        lines.append(f"{place}. {display_name} - **{workout_count}** тренувань")
+
+    my_rank = leaderboard.rank(message.from_user.id)
+    if my_rank:
+        place, workout_count = my_rank
+        lines.append(f"\nВаше місце: **{place}** з {len(leaderboard)} ({workout_count} тренувань)")
+    else:
+        lines.append("\nВи ще не тренувались цього тижня. Саме час почати!")
+    await answer_message_safely(message, "\n".join(lines))
 @router.message(Command("tip"))
 async def cmd_tip(message: Message):
     await message.answer("🧠 Генерую корисну пораду...")
@@ -96,10 +207,11 @@ async def process_feedback_comment(message: Message, state: FSMContext):
         await message.answer("Щось пішло не так, не можу знайти ваш план. Спробуйте /start.")
         await state.clear()
         return
-    await message.answer("Аналізую ваш відгук та коригую план... Це може зайняти хвилину.")
-    new_plan = await gemini.adjust_fitness_plan(user_data, current_plan, rating, comment)
+    progress = ProgressiveMessage(message, "Аналізую ваш відгук та коригую план...")
+    await progress.start()
+    new_plan = await gemini.adjust_fitness_plan(user_data, current_plan, rating, comment, on_text=progress.update)
     await db.save_fitness_plan(user_id, new_plan)
-    await message.answer("✅ Ваш план оновлено! Ось нова версія:")
-    await answer_message_safely(message, new_plan)
+    await progress.finish(new_plan)
+    await message.answer("✅ Ваш план оновлено!")
     await state.clear()
 
@@ -69,4 +69,12 @@ def get_meal_confirmation_kb():
     builder = InlineKeyboardBuilder()
     builder.button(text="✅ Так, записати", callback_data="confirm_meal")
     builder.button(text="❌ Ні, скасувати", callback_data="cancel_meal")
+    return builder.as_markup()
+
+def get_frequent_meals_kb(meals):
+    builder = InlineKeyboardBuilder()
+    for meal in meals:
+        description = meal['description'] if len(meal['description']) <= 40 else meal['description'][:39] + "…"
+        builder.button(text=f"🔁 {description} · {meal['calories']} ккал", callback_data=f"quick_meal:{meal['id']}")
+    builder.adjust(1)
     return builder.as_markup()
\ No newline at end of file
@@ -0,0 +1,113 @@
+"""
+Тижневий лідерборд за кількістю тренувань.
+
+Лічильники поточного тижня зберігаються в таблиці weekly_workouts і
+дзеркалюються в пам'яті. Дерево Фенвіка по кількості тренувань дає місце
+користувача за O(log n), а кошики "кількість -> користувачі" - топ-N без
+сортування всіх учасників. Коли починається новий тиждень, лідерборд
+обнуляється.
+"""
+import heapq
+import database as db
+
+
+class _FenwickTree:
+    """Дерево Фенвіка: скільки користувачів мають кожну кількість тренувань."""
+
+    def __init__(self, size: int = 64):
+        self.tree = [0] * (size + 1)
+
+    def _grow(self, index: int):
+        size = len(self.tree) - 1
+        while index > size:
+            size *= 2
+        if size + 1 > len(self.tree):
+            values = [self.prefix_sum(i) - self.prefix_sum(i - 1) for i in range(1, len(self.tree))]
+            self.tree = [0] * (size + 1)
+            for i, value in enumerate(values, start=1):
+                if value:
+                    self.add(i, value)
+
+    def add(self, index: int, delta: int):
+        self._grow(index)
+        while index < len(self.tree):
+            self.tree[index] += delta
+            index += index & -index
+
+    def prefix_sum(self, index: int) -> int:
+        index = min(index, len(self.tree) - 1)
+        total = 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+
+class WeeklyLeaderboard:
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.week = db.week_number()
+        self.counts: dict[int, int] = {}
+        self.buckets: dict[int, set[int]] = {}
+        self.tree = _FenwickTree()
+        self.max_count = 0
+
+    def _roll_over(self):
+        """Обнуляє лідерборд, якщо почався новий тиждень."""
+        if db.week_number() != self.week:
+            self._reset()
+
+    def _set(self, user_id: int, workouts: int):
+        old = self.counts.get(user_id, 0)
+        if old == workouts:
+            return
+        if old:
+            self.buckets[old].discard(user_id)
+            if not self.buckets[old]:
+                del self.buckets[old]
+            self.tree.add(old, -1)
+        self.counts[user_id] = workouts
+        self.buckets.setdefault(workouts, set()).add(user_id)
+        self.tree.add(workouts, 1)
+        self.max_count = max(self.max_count, workouts)
+
+    async def load(self):
+        """Завантажує лічильники поточного тижня з БД."""
+        self._reset()
+        for user_id, workouts in await db.get_weekly_workouts(self.week):
+            self._set(user_id, workouts)
+
+    def update(self, user_id: int, workouts: int):
+        """Записує нову кількість тренувань користувача за поточний тиждень."""
+        self._roll_over()
+        self._set(user_id, workouts)
+
+    def top(self, limit: int = 3) -> list[tuple[int, int]]:
+        """Повертає до limit пар (user_id, workouts) у порядку спадання."""
+        self._roll_over()
+        result = []
+        count = self.max_count
+        while count > 0 and len(result) < limit:
+            bucket = self.buckets.get(count)
+            if bucket:
+                for user_id in heapq.nsmallest(limit - len(result), bucket):
+                    result.append((user_id, count))
+            count -= 1
+        return result
+
+    def rank(self, user_id: int) -> tuple[int, int] | None:
+        """Повертає (місце, кількість тренувань) користувача або None, якщо він цього тижня не тренувався."""
+        self._roll_over()
+        workouts = self.counts.get(user_id)
+        if not workouts:
+            return None
+        ahead = len(self.counts) - self.tree.prefix_sum(workouts)
+        return ahead + 1, workouts
+
+    def __len__(self):
+        return len(self.counts)
+
+
+leaderboard = WeeklyLeaderboard()
@@ -3,13 +3,18 @@ import logging
 from aiogram import Bot, Dispatcher
 from config import TELEGRAM_BOT_TOKEN
 from handlers import common, onboarding, user_commands, community_handler, group_handler, tools_handler, menu_handler, nutrition_handler
-from database import init_db
-from scheduler import setup_scheduler
+from database import init_db, close_db
+from leaderboard import leaderboard
+import food_db
+import outbox
+from scheduler import setup_scheduler, resume_broadcasts
 from middlewares.subscription import SubscriptionMiddleware
 from bot_commands import set_bot_commands  # імпорт функції
 
 async def main():
     await init_db()
+    await leaderboard.load()
+    food_db.load()
 
     logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
 
@@ -33,11 +38,18 @@ async def main():
 
     # Планувальник
     scheduler = setup_scheduler(bot)  # старт тут виконується всередині setup_scheduler
+    outbox.start_worker(bot)
+    await resume_broadcasts(bot)
     
     # Запуск бота
     await bot.delete_webhook(drop_pending_updates=True)
 
-    await dp.start_polling(bot, scheduler=scheduler) # запустимо планувальник
+    try:
+        await dp.start_polling(bot, scheduler=scheduler) # запустимо планувальник
+    finally:
+        scheduler.shutdown(wait=False)
+        await outbox.stop_worker()
+        await close_db()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,79 @@
+import json
+import re
+
+from cachetools import TTLCache
+
+import database as db
+import gemini
+
+MEAL_CACHE_TTL = 30 * 86400  # секунд; калорійність страв з часом не змінюється
+MEAL_MEMORY_CACHE_SIZE = 2048
+
+# Канонічні одиниці виміру та їхні поширені написання
+_UNIT_ALIASES = {
+    "г": ("г", "гр", "грм", "грам", "грама", "грами", "грамів", "g", "gr"),
+    "кг": ("кг", "кіло", "кілограм", "кілограма", "кілограми", "кілограмів", "kg"),
+    "мл": ("мл", "мілілітр", "мілілітра", "мілілітри", "мілілітрів", "ml"),
+    "л": ("л", "літр", "літра", "літри", "літрів"),
+    "шт": ("шт", "штука", "штуки", "штук"),
+}
+_UNITS = {alias: unit for unit, aliases in _UNIT_ALIASES.items() for alias in aliases}
+
+# Перший рівень - LRU з TTL у пам'яті, другий - таблиця meal_cache
+_memory_cache = TTLCache(maxsize=MEAL_MEMORY_CACHE_SIZE, ttl=MEAL_CACHE_TTL)
+stats = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+
+
+def normalize_description(description: str) -> str:
+    """
+    Ключ кешу для опису страви: нижній регістр, єдиний апостроф, без пунктуації
+    та зайвих пробілів, одиниці виміру в канонічній формі ("200гр." -> "200 г").
+    """
+    text = description.lower().strip()
+    text = re.sub(r"[’ʼ`‘]", "'", text)
+    text = re.sub(r"(\d),(\d)", r"\1.\2", text)
+    text = re.sub(r"(\d)([^\W\d_])", r"\1 \2", text)
+    text = re.sub(r"[^\w\s'.]", " ", text)
+    text = re.sub(r"(?<!\d)\.|\.(?!\d)", " ", text)
+    return " ".join(_UNITS.get(token, token) for token in text.split())
+
+
+def _is_cacheable(meal_data) -> bool:
+    return isinstance(meal_data, dict) and "error" not in meal_data and bool(meal_data.get("meal_name"))
+
+
+async def analyze_meal(description: str) -> dict:
+    """
+    Аналіз страви з кешем: спершу пам'ять, потім SQLite, і лише тоді Gemini.
+    Повертає розібраний JSON; кешуються тільки успішні відповіді.
+    """
+    key = normalize_description(description)
+    if key in _memory_cache:
+        stats["memory_hits"] += 1
+        return dict(_memory_cache[key])
+
+    cached = await db.get_cached_meal(key, db.now_epoch() - MEAL_CACHE_TTL)
+    if cached:
+        stats["db_hits"] += 1
+        meal_data = json.loads(cached)
+        _memory_cache[key] = meal_data
+        return dict(meal_data)
+
+    stats["misses"] += 1
+    response = await gemini.analyze_meal(description)
+    meal_data = json.loads(response)
+    if not _is_cacheable(meal_data):
+        # Помилка або JSON не того вигляду (список, рядок) - звичайна відповідь з помилкою
+        return meal_data if isinstance(meal_data, dict) else {"error": gemini.MEAL_ANALYSIS_ERROR}
+    _memory_cache[key] = meal_data
+    try:
+        await db.cache_meal(key, json.dumps(meal_data, ensure_ascii=False))
+    except Exception as e:
+        # Без запису в SQLite відповідь лишається в кеші пам'яті, аналіз не зривається
+        print(f"[MEAL_CACHE] Не вдалося зберегти аналіз страви '{key}': {e}")
+    return dict(meal_data)
+
+
+def hit_rate() -> float:
+    total = sum(stats.values())
+    return (stats["memory_hits"] + stats["db_hits"]) / total if total else 0.0
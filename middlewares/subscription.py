@@ -24,7 +24,7 @@ class SubscriptionMiddleware(BaseMiddleware):
             if command in PUBLIC_COMMANDS:
                 return await handler(event, data)
 
-        status, expiry_date = await db.get_user_subscription_status(user_id)
+        status, expiry_date = await db.get_cached_subscription_status(user_id)
 
         if status in ['trial', 'active']:
             return await handler(event, data)
@@ -0,0 +1,443 @@
+"""
+Нумеровані міграції схеми БД.
+
+Поточна версія схеми зберігається в PRAGMA user_version, тож на вже
+актуальній базі старт коштує одну перевірку версії. Нову міграцію додаємо
+в кінець MIGRATIONS з наступним номером; вже випущені міграції не змінюємо.
+"""
+import aiosqlite
+from datetime import datetime
+import pytz
+
+KYIV_TZ = pytz.timezone("Europe/Kiev")
+
+def _iso_to_epoch(value: str | None) -> int | None:
+    """Переводить збережений ISO-рядок у секунди epoch; дати без зони вважаються київськими."""
+    if not value:
+        return None
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = KYIV_TZ.localize(dt)
+    return int(dt.timestamp())
+
+async def _create_base_schema(db: aiosqlite.Connection):
+    """Базові таблиці бота."""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            registration_date TEXT,
+            onboarding_data TEXT,
+            fitness_plan TEXT,
+            plan_start_date TEXT,
+            subscription_status TEXT DEFAULT 'none',
+            subscription_expiry_date TEXT,
+            is_active BOOLEAN DEFAULT TRUE,
+            in_group BOOLEAN DEFAULT FALSE,
+            reminder_breakfast TEXT DEFAULT '09:00',
+            reminder_lunch TEXT DEFAULT '14:00',
+            reminder_dinner TEXT DEFAULT '19:00',
+            daily_activity_level TEXT
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS food_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            meal_description TEXT,
+            calories INTEGER,
+            proteins REAL,
+            fats REAL,
+            carbs REAL,
+            created_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS progress (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            date TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS achievements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            achievement_id TEXT,
+            date_achieved TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
+            UNIQUE(user_id, achievement_id)
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS pending_payments (
+            user_id INTEGER PRIMARY KEY,
+            payment_code TEXT,
+            created_at TEXT
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS public_challenges (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            author_id INTEGER,
+            title TEXT,
+            description TEXT,
+            duration_days INTEGER,
+            created_at TEXT,
+            is_active BOOLEAN DEFAULT TRUE
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS challenge_participants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            challenge_id INTEGER,
+            user_id INTEGER,
+            progress_days INTEGER DEFAULT 0,
+            last_completion_date TEXT,
+            FOREIGN KEY (challenge_id) REFERENCES public_challenges (id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
+            UNIQUE(challenge_id, user_id)
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS duels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            initiator_id INTEGER,
+            opponent_id INTEGER,
+            description TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TEXT,
+            initiator_completed BOOLEAN DEFAULT FALSE,
+            opponent_completed BOOLEAN DEFAULT FALSE,
+            winner_id INTEGER
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS user_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            photo_file_id TEXT NOT NULL,
+            date_added TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )''')
+    
+    # Старі бази могли бути створені без колонок виконання дуелі
+    cursor = await db.execute("PRAGMA table_info(duels)")
+    columns = [row[1] for row in await cursor.fetchall()]
+    
+    if 'initiator_completed' not in columns:
+        print("Виконую міграцію: додаю колонку 'initiator_completed' до таблиці 'duels'.")
+        await db.execute("ALTER TABLE duels ADD COLUMN initiator_completed BOOLEAN DEFAULT FALSE")
+    
+    if 'opponent_completed' not in columns:
+        print("Виконую міграцію: додаю колонку 'opponent_completed' до таблиці 'duels'.")
+        await db.execute("ALTER TABLE duels ADD COLUMN opponent_completed BOOLEAN DEFAULT FALSE")
+
+async def _add_hot_path_indexes(db: aiosqlite.Connection):
+    """Індекси для запитів, що виконуються найчастіше."""
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_food_log_user_created ON food_log (user_id, created_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_progress_user_date ON progress (user_id, date)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_is_active ON users (is_active)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_challenge_participants_user ON challenge_participants (user_id)")
+
+async def _add_subscription_expiry_index(db: aiosqlite.Connection):
+    """Індекс для масового завершення прострочених підписок."""
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_subscription ON users (subscription_status, subscription_expiry_date)")
+
+# (таблиця, стара ISO-колонка, нова epoch-колонка)
+_EPOCH_COLUMNS = [
+    ("progress", "date", "date_ts"),
+    ("food_log", "created_at", "created_ts"),
+    ("achievements", "date_achieved", "achieved_ts"),
+    ("users", "subscription_expiry_date", "subscription_expiry_ts"),
+]
+
+async def _convert_timestamps_to_epoch(db: aiosqlite.Connection):
+    """Переводить часові колонки з ISO-рядків у цілі секунди epoch."""
+    # Індекси по старих колонках заважають їх видаленню
+    await db.execute("DROP INDEX IF EXISTS idx_progress_user_date")
+    await db.execute("DROP INDEX IF EXISTS idx_food_log_user_created")
+    await db.execute("DROP INDEX IF EXISTS idx_users_subscription")
+
+    for table, old_column, new_column in _EPOCH_COLUMNS:
+        key = "user_id" if table == "users" else "id"
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {new_column} INTEGER")
+        cursor = await db.execute(f"SELECT {key}, {old_column} FROM {table} WHERE {old_column} IS NOT NULL")
+        rows = await cursor.fetchall()
+        await db.executemany(
+            f"UPDATE {table} SET {new_column} = ? WHERE {key} = ?",
+            [(_iso_to_epoch(value), row_id) for row_id, value in rows]
+        )
+        await db.execute(f"ALTER TABLE {table} DROP COLUMN {old_column}")
+
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_progress_user_date_ts ON progress (user_id, date_ts)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_food_log_user_created_ts ON food_log (user_id, created_ts)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_subscription_ts ON users (subscription_status, subscription_expiry_ts)")
+
+async def _create_daily_nutrition(db: aiosqlite.Connection):
+    """Таблиця денних підсумків харчування, заповнена з food_log."""
+    from database import parse_calories, parse_macro, day_start_epoch, from_epoch
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS daily_nutrition (
+            user_id INTEGER,
+            day INTEGER,
+            calories INTEGER NOT NULL DEFAULT 0,
+            proteins REAL NOT NULL DEFAULT 0,
+            fats REAL NOT NULL DEFAULT 0,
+            carbs REAL NOT NULL DEFAULT 0,
+            meals INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day),
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )
+    ''')
+
+    totals = {}
+    cursor = await db.execute("SELECT user_id, calories, proteins, fats, carbs, created_ts FROM food_log WHERE created_ts IS NOT NULL")
+    for user_id, calories, proteins, fats, carbs, created_ts in await cursor.fetchall():
+        key = (user_id, day_start_epoch(from_epoch(created_ts)))
+        day = totals.setdefault(key, [0, 0.0, 0.0, 0.0, 0])
+        day[0] += parse_calories(calories)
+        day[1] += parse_macro(proteins)
+        day[2] += parse_macro(fats)
+        day[3] += parse_macro(carbs)
+        day[4] += 1
+
+    await db.executemany(
+        "INSERT INTO daily_nutrition (user_id, day, calories, proteins, fats, carbs, meals) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(*key, *values) for key, values in totals.items()]
+    )
+
+async def _create_workout_stats(db: aiosqlite.Connection):
+    """Лічильники тренувань користувачів, заповнені з progress."""
+    from database import WORKOUT_WINDOW_DAYS, day_number
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS workout_stats (
+            user_id INTEGER PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            last_day INTEGER NOT NULL,
+            recent BLOB NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )
+    ''')
+
+    workout_days = {}
+    cursor = await db.execute("SELECT user_id, date_ts FROM progress WHERE date_ts IS NOT NULL")
+    for user_id, date_ts in await cursor.fetchall():
+        workout_days.setdefault(user_id, []).append(day_number(date_ts))
+
+    rows = []
+    for user_id, days in workout_days.items():
+        last_day = max(days)
+        recent = bytearray(WORKOUT_WINDOW_DAYS)
+        for day in days:
+            if last_day - day < WORKOUT_WINDOW_DAYS:
+                recent[last_day - day] = min(recent[last_day - day] + 1, 255)
+        rows.append((user_id, len(days), last_day, bytes(recent)))
+
+    await db.executemany("INSERT INTO workout_stats (user_id, total, last_day, recent) VALUES (?, ?, ?, ?)", rows)
+
+async def _create_weekly_workouts(db: aiosqlite.Connection):
+    """Потижневі лічильники тренувань для лідерборду, заповнені з progress."""
+    from database import week_number
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS weekly_workouts (
+            week INTEGER,
+            user_id INTEGER,
+            workouts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (week, user_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )
+    ''')
+
+    counts = {}
+    cursor = await db.execute("SELECT user_id, date_ts FROM progress WHERE date_ts IS NOT NULL")
+    for user_id, date_ts in await cursor.fetchall():
+        key = (week_number(date_ts), user_id)
+        counts[key] = counts.get(key, 0) + 1
+
+    await db.executemany(
+        "INSERT INTO weekly_workouts (week, user_id, workouts) VALUES (?, ?, ?)",
+        [(*key, workouts) for key, workouts in counts.items()]
+    )
+
+async def _add_meal_reminder_indexes(db: aiosqlite.Connection):
+    """Індекси часу нагадувань про їжу для щохвилинної вибірки."""
+    for meal in ("breakfast", "lunch", "dinner"):
+        await db.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_users_reminder_{meal} ON users (reminder_{meal}, is_active)"
+        )
+
+async def _create_outbox(db: aiosqlite.Connection):
+    """Черга вихідних повідомлень з повторними спробами."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            kwargs TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_ts INTEGER NOT NULL,
+            last_error TEXT,
+            created_ts INTEGER NOT NULL
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_ts)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_outbox_chat ON outbox (status, chat_id, id)")
+
+async def _create_broadcast_runs(db: aiosqlite.Connection):
+    """Контрольні точки масових розсилок для відновлення після перезапуску."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_runs (
+            run_id TEXT PRIMARY KEY,
+            job TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            enqueued INTEGER NOT NULL DEFAULT 0,
+            started_ts INTEGER NOT NULL,
+            finished_ts INTEGER
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_runs_status ON broadcast_runs (status, started_ts)")
+
+async def _add_user_deactivation(db: aiosqlite.Connection):
+    """Час деактивації користувачів, недосяжних для бота."""
+    await db.execute("ALTER TABLE users ADD COLUMN deactivated_ts INTEGER")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_deactivated_ts ON users (deactivated_ts)")
+
+async def _add_challenge_expiry(db: aiosqlite.Connection):
+    """Час завершення челенджів для періодичного очищення замість окремих задач планувальника."""
+    await db.execute("ALTER TABLE public_challenges ADD COLUMN expires_ts INTEGER")
+    cursor = await db.execute("SELECT id, created_at, duration_days FROM public_challenges")
+    rows = await cursor.fetchall()
+    await db.executemany(
+        "UPDATE public_challenges SET expires_ts = ? WHERE id = ?",
+        [
+            (_iso_to_epoch(created_at) + (duration_days or 0) * 86400, challenge_id)
+            for challenge_id, created_at, duration_days in rows
+            if created_at
+        ]
+    )
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_public_challenges_expires_ts ON public_challenges (expires_ts)")
+    # Сховище разових задач видалення челенджів більше не потрібне
+    await db.execute("DROP TABLE IF EXISTS apscheduler_jobs")
+
+async def _create_broadcast_windows(db: aiosqlite.Connection):
+    """Налаштовані адміном вікна доставки масових розсилок."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_windows (
+            job TEXT PRIMARY KEY,
+            window_minutes INTEGER NOT NULL
+        )
+    """)
+
+async def _create_meal_cache(db: aiosqlite.Connection):
+    """Кеш відповідей Gemini для аналізу страв за нормалізованим описом."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS meal_cache (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            created_ts INTEGER NOT NULL
+        )
+    """)
+
+async def _create_frequent_meals(db: aiosqlite.Connection):
+    """Часті страви користувачів для швидкого запису, заповнені з food_log."""
+    from database import FREQUENT_MEALS_KEEP, meal_key, parse_calories, parse_macro
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS frequent_meals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            meal_key TEXT NOT NULL,
+            description TEXT NOT NULL,
+            calories INTEGER NOT NULL,
+            proteins REAL NOT NULL,
+            fats REAL NOT NULL,
+            carbs REAL NOT NULL,
+            uses INTEGER NOT NULL DEFAULT 1,
+            last_used_ts INTEGER NOT NULL,
+            UNIQUE (user_id, meal_key),
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_frequent_meals_user_used ON frequent_meals (user_id, last_used_ts)")
+
+    meals = {}
+    cursor = await db.execute(
+        "SELECT user_id, meal_description, calories, proteins, fats, carbs, created_ts FROM food_log "
+        "WHERE created_ts IS NOT NULL AND meal_description IS NOT NULL ORDER BY created_ts, id"
+    )
+    for order, (user_id, description, calories, proteins, fats, carbs, created_ts) in enumerate(await cursor.fetchall()):
+        key = (user_id, meal_key(description))
+        uses = meals[key][6] + 1 if key in meals else 1
+        # Зберігаємо КБЖВ останнього запису, як і log_meal
+        meals[key] = [description, parse_calories(calories), parse_macro(proteins),
+                      parse_macro(fats), parse_macro(carbs), created_ts, uses, order]
+
+    per_user = {}
+    for (user_id, key), values in meals.items():
+        per_user.setdefault(user_id, []).append((key, values))
+    rows = []
+    for user_id, user_meals in per_user.items():
+        user_meals.sort(key=lambda item: item[1][7], reverse=True)
+        for key, (description, calories, proteins, fats, carbs, last_used_ts, uses, _) in user_meals[:FREQUENT_MEALS_KEEP]:
+            rows.append((user_id, key, description, calories, proteins, fats, carbs, uses, last_used_ts))
+    await db.executemany(
+        "INSERT INTO frequent_meals (user_id, meal_key, description, calories, proteins, fats, carbs, uses, last_used_ts) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+
+MIGRATIONS = [
+    (1, _create_base_schema),
+    (2, _add_hot_path_indexes),
+    (3, _add_subscription_expiry_index),
+    (4, _convert_timestamps_to_epoch),
+    (5, _create_daily_nutrition),
+    (6, _create_workout_stats),
+    (7, _create_weekly_workouts),
+    (8, _add_meal_reminder_indexes),
+    (9, _create_outbox),
+    (10, _create_broadcast_runs),
+    (11, _add_user_deactivation),
+    (12, _add_challenge_expiry),
+    (13, _create_broadcast_windows),
+    (14, _create_meal_cache),
+    (15, _create_frequent_meals),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    cursor = await db.execute("PRAGMA user_version")
+    row = await cursor.fetchone()
+    return row[0]
+
+async def migrate(db: aiosqlite.Connection):
+    """Застосовує всі міграції, новіші за збережену версію схеми."""
+    version = await get_schema_version(db)
+    if version >= SCHEMA_VERSION:
+        return
+
+    for number, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        print(f"Виконую міграцію {number}: {migration.__doc__}")
+        # Кожна міграція разом з новим номером версії - окрема транзакція
+        await db.commit()
+        await db.execute("BEGIN")
+        try:
+            await migration(db)
+            await db.execute(f"PRAGMA user_version = {number}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
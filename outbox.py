@@ -0,0 +1,214 @@
+import asyncio
+import json
+import time
+from typing import AsyncIterable, Callable, Iterable
+
+from aiogram import Bot
+from aiogram.types import ForceReply, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
+
+import database as db
+from utils.broadcast import RETRY, SENT, UNREACHABLE, BroadcastStats, send_all
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_IDLE_INTERVAL = 30  # секунд між перевірками, коли черга порожня
+ENQUEUE_CHUNK_SIZE = 500
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 5  # секунд, подвоюється з кожною спробою
+RETRY_MAX_DELAY = 600
+
+# Типи клавіатур, які можна зберегти в outbox
+_MARKUP_TYPES = {cls.__name__: cls for cls in (InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, ForceReply)}
+
+_wakeup = asyncio.Event()
+_worker_task: asyncio.Task | None = None
+
+
+def dump_kwargs(kwargs: dict) -> str | None:
+    """Серіалізує аргументи send_message (разом з клавіатурою) у JSON."""
+    if not kwargs:
+        return None
+    data = dict(kwargs)
+    markup = data.pop("reply_markup", None)
+    if markup is not None:
+        data["reply_markup"] = {"type": type(markup).__name__, "data": markup.model_dump(exclude_none=True)}
+    return json.dumps(data, ensure_ascii=False)
+
+
+def load_kwargs(raw: str | None) -> dict:
+    """Відновлює аргументи send_message, збережені dump_kwargs."""
+    if not raw:
+        return {}
+    data = json.loads(raw)
+    markup = data.pop("reply_markup", None)
+    if markup is not None:
+        data["reply_markup"] = _MARKUP_TYPES[markup["type"]].model_validate(markup["data"])
+    return data
+
+
+def delivery_slot(chat_id: int, window: int) -> int:
+    """Детермінований зсув чату (в секундах) у межах вікна доставки window."""
+    if window <= 0:
+        return 0
+    # Мультиплікативний хеш Кнута рівномірно розкидає навіть послідовні id
+    return (chat_id * 2654435761 % 2 ** 32) % window
+
+
+async def enqueue_many(deliveries: AsyncIterable | Iterable, send_at: int | None = None,
+                       run_id: str | None = None, window: int = 0) -> int:
+    """
+    Записує потік (chat_id, текст, kwargs) в outbox пакетами. Повертає кількість повідомлень.
+    З run_id кожен пакет зсуває контрольну точку розсилки на останній chat_id.
+    З window (секунд) кожен чат отримує повідомлення у свій слот після send_at.
+    """
+    send_at = send_at or db.now_epoch()
+    chunk, total = [], 0
+
+    async def flush():
+        nonlocal chunk, total
+        await db.enqueue_messages(chunk, run_id)
+        total += len(chunk)
+        chunk = []
+        _wakeup.set()
+
+    if isinstance(deliveries, AsyncIterable):
+        async for chat_id, text, kwargs in deliveries:
+            chunk.append((chat_id, text, dump_kwargs(kwargs), send_at + delivery_slot(chat_id, window)))
+            if len(chunk) >= ENQUEUE_CHUNK_SIZE:
+                await flush()
+    else:
+        for chat_id, text, kwargs in deliveries:
+            chunk.append((chat_id, text, dump_kwargs(kwargs), send_at + delivery_slot(chat_id, window)))
+            if len(chunk) >= ENQUEUE_CHUNK_SIZE:
+                await flush()
+    if chunk:
+        await flush()
+    return total
+
+
+async def enqueue(chat_id: int, text: str, **kwargs):
+    """Ставить одне повідомлення в outbox."""
+    await enqueue_many([(chat_id, text, kwargs)])
+
+
+async def broadcast(name: str, deliveries: AsyncIterable | Iterable, window: int = 0,
+                    send_at: int | None = None) -> int:
+    """Ставить розсилку в outbox; саму відправку виконує фоновий воркер."""
+    started = time.monotonic()
+    total = await enqueue_many(deliveries, send_at, window=window)
+    print(f"[OUTBOX] {name}: поставлено в чергу {total} повідомлень за {time.monotonic() - started:.2f} с")
+    return total
+
+
+async def run_broadcast(run_id: str, job: str, make_deliveries: Callable[[int], AsyncIterable],
+                        window: int = 0) -> int:
+    """
+    Розсилка з контрольною точкою: make_deliveries(after_user_id) має віддавати повідомлення
+    у порядку зростання user_id. Завершений запуск повторно не виконується, перерваний -
+    продовжується з останнього поставленого в чергу користувача. Вікно доставки
+    відраховується від початку запуску, тож після відновлення слоти не змінюються.
+    """
+    run = await db.get_broadcast_run(run_id)
+    if run and run['status'] != 'running':
+        print(f"[OUTBOX] {run_id}: розсилка вже має статус {run['status']}, пропускаю")
+        return 0
+    if run:
+        print(f"[OUTBOX] {run_id}: продовжую з користувача {run['last_user_id']}")
+        started_ts = run['started_ts']
+    else:
+        started_ts = db.now_epoch()
+        await db.start_broadcast_run(run_id, job, started_ts)
+    started = time.monotonic()
+    total = await enqueue_many(
+        make_deliveries(run['last_user_id'] if run else 0), started_ts, run_id=run_id, window=window
+    )
+    await db.finish_broadcast_run(run_id)
+    print(f"[OUTBOX] {run_id}: поставлено в чергу {total} повідомлень за {time.monotonic() - started:.2f} с")
+    return total
+
+
+async def to_each(user_ids: AsyncIterable, text: str, **kwargs):
+    """Перетворює потік рядків користувачів на однакові повідомлення для кожного."""
+    async for user_id, *_ in user_ids:
+        yield user_id, text, kwargs
+
+
+def _retry_delay(attempts: int) -> int:
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+async def _deliver_batch(bot: Bot, rows, stats: BroadcastStats):
+    results = await send_all(bot, [(row['chat_id'], row['text'], load_kwargs(row['kwargs'])) for row in rows])
+    now = db.now_epoch()
+    sent, retry, dead, unreachable = [], [], [], []
+    for row, (result, retry_after, error) in zip(rows, results):
+        if result == SENT:
+            sent.append(row['id'])
+        elif result == UNREACHABLE:
+            dead.append((row['attempts'] + 1, str(error), row['id']))
+            unreachable.append(row['chat_id'])
+        elif result == RETRY and retry_after is not None:
+            # Флуд-контроль - не провина повідомлення, спробу не рахуємо
+            retry.append((row['attempts'], now + retry_after, str(error), row['id']))
+        elif result == RETRY and row['attempts'] + 1 < MAX_ATTEMPTS:
+            attempts = row['attempts'] + 1
+            retry.append((attempts, now + _retry_delay(attempts), str(error), row['id']))
+        else:
+            print(f"[OUTBOX] Повідомлення {row['id']} для {row['chat_id']} не доставлено: {error}")
+            dead.append((row['attempts'] + 1, str(error), row['id']))
+    await db.complete_outbox(sent, retry, dead, unreachable)
+    if unreachable:
+        print(f"[OUTBOX] Деактивовано недосяжних користувачів: {len(unreachable)}")
+    stats.sent += len(sent)
+    stats.retries += len(retry)
+    stats.failed += len(dead)
+
+
+async def _wait_for_work():
+    next_attempt = await db.get_next_outbox_attempt()
+    timeout = OUTBOX_IDLE_INTERVAL
+    if next_attempt is not None:
+        timeout = min(max(next_attempt - db.now_epoch(), 0) + 0.5, OUTBOX_IDLE_INTERVAL)
+    try:
+        await asyncio.wait_for(_wakeup.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    _wakeup.clear()
+
+
+async def run_worker(bot: Bot):
+    """Фоновий цикл доставки повідомлень з outbox."""
+    stats = None
+    while True:
+        try:
+            rows = await db.fetch_due_outbox(OUTBOX_BATCH_SIZE)
+            if rows:
+                stats = stats or BroadcastStats("outbox")
+                await _deliver_batch(bot, rows, stats)
+                continue
+            if stats:
+                stats.finished = time.monotonic()
+                print(stats)
+                stats = None
+            await _wait_for_work()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[OUTBOX] Помилка воркера: {e}")
+            await asyncio.sleep(1)
+
+
+def start_worker(bot: Bot):
+    global _worker_task
+    _worker_task = asyncio.create_task(run_worker(bot))
+
+
+async def stop_worker():
+    global _worker_task
+    if _worker_task is None:
+        return
+    _worker_task.cancel()
+    try:
+        await _worker_task
+    except asyncio.CancelledError:
+        pass
+    _worker_task = None
@@ -5,11 +5,14 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 import database as db
 import keyboards as kb
 import achievements
+from leaderboard import leaderboard
 from datetime import datetime, timedelta
 import pytz  # <-- Додано
 from utils.safe_sender import send_message_safely
+from outbox import broadcast, enqueue, enqueue_many, run_broadcast, to_each
 from config import GROUP_ID, GROUP_INVITE_LINK
-from handlers.nutrition_handler import send_daily_summary
+from handlers.nutrition_handler import NO_MEALS_TEXT, build_daily_report, daily_analysis_key, get_daily_analysis
+import asyncio
 import re
 from aiogram.filters import Command
 from aiogram import Router, F
@@ -37,175 +40,271 @@ DAY_MAP = {
     "Sunday": "Неділя",
 }
 
+async def build_today_workout_message(user_id: int, is_reminder: bool = False):
+    """Повертає (текст, клавіатура) з тренуванням на сьогодні або None, якщо надсилати нічого."""
+    today_english = get_current_kyiv_time().strftime('%A')
+    today_ukrainian = DAY_MAP.get(today_english)
+
+    if not today_ukrainian:
+        print(f"Помилка: не вдалося визначити український день для {today_english}")
+        return None if is_reminder else ("Виникла системна помилка, спробуйте пізніше.", None)
+
+    plan = await db.get_user_plan(user_id)
+    if not plan:
+        return None if is_reminder else ("У вас ще немає активного плану тренувань. Створіть його за допомогою команди /create_plan", None)
+
+    pattern = re.compile(rf"\*\*{today_ukrainian}.*?\*\*([\s\S]*?)(?=\n\*\*|\Z)", re.IGNORECASE)
+    match = pattern.search(plan)
+
+    if match:
+        workout_for_today = match.group(0).strip()
+        if "відпочинок" in workout_for_today.lower():
+            text = f"Сьогодні у вас за планом **день відпочинку** 🧘. Насолоджуйтесь!"
+            return (f"Привіт! {text.lower()}" if not is_reminder else text), None
+        text = (
+            f"Привіт! Нагадую про ваше сьогоднішнє тренування. Ваш шлях до мети продовжується! 💪\n\n"
+            if is_reminder else
+            f"Ось ваше тренування на сьогодні. Вперед до мети! 💪\n\n"
+        ) + workout_for_today
+        return text, kb.confirm_workout_kb
+    return None if is_reminder else ("Схоже, у вашому плані немає тренування на сьогодні.", None)
+
 async def send_today_workout_for_user(user_id: int, bot: Bot, is_reminder: bool = False):
     try:
-        today_english = get_current_kyiv_time().strftime('%A')
-        today_ukrainian = DAY_MAP.get(today_english)
-
-        if not today_ukrainian:
-            print(f"Помилка: не вдалося визначити український день для {today_english}")
-            if not is_reminder:
-                await send_message_safely(bot, user_id, "Виникла системна помилка, спробуйте пізніше.")
-            return
-
-        plan = await db.get_user_plan(user_id)
-        if not plan:
-            if not is_reminder:
-                await send_message_safely(bot, user_id, "У вас ще немає активного плану тренувань. Створіть його за допомогою команди /create_plan")
-            return
-
-        pattern = re.compile(rf"\*\*{today_ukrainian}.*?\*\*([\s\S]*?)(?=\n\*\*|\Z)", re.IGNORECASE)
-        match = pattern.search(plan)
-
-        if match:
-            workout_for_today = match.group(0).strip()
-            if "відпочинок" in workout_for_today.lower():
-                text = f"Сьогодні у вас за планом **день відпочинку** 🧘. Насолоджуйтесь!"
-                await send_message_safely(bot, user_id, f"Привіт! {text.lower()}" if not is_reminder else text)
-            else:
-                text = (
-                    f"Привіт! Нагадую про ваше сьогоднішнє тренування. Ваш шлях до мети продовжується! 💪\n\n"
-                    if is_reminder else
-                    f"Ось ваше тренування на сьогодні. Вперед до мети! 💪\n\n"
-                ) + workout_for_today
-                await send_message_safely(bot, user_id, text, reply_markup=kb.confirm_workout_kb)
-        else:
-            if not is_reminder:
-                await send_message_safely(bot, user_id, "Схоже, у вашому плані немає тренування на сьогодні.")
+        message = await build_today_workout_message(user_id, is_reminder)
+        if message:
+            text, markup = message
+            await send_message_safely(bot, user_id, text, reply_markup=markup)
     except Exception as e:
         print(f"Не вдалося надіслати тренування на сьогодні користувачу {user_id}: {e}")
         if not is_reminder:
             await send_message_safely(bot, user_id, "Виникла помилка при спробі отримати ваше тренування.")
 
+async def _daily_reminders(bot: Bot, after_user_id: int):
+    async for user_id, *_ in db.iter_active_users(after_user_id):
+        try:
+            message = await build_today_workout_message(user_id, is_reminder=True)
+        except Exception as e:
+            print(f"Не вдалося підготувати нагадування користувачу {user_id}: {e}")
+            continue
+        if message:
+            text, markup = message
+            yield user_id, text, {"reply_markup": markup}
+
 async def send_daily_reminder(bot: Bot):
-    users = await db.get_all_active_users()
-    for user_id, *_ in users:
-        await send_today_workout_for_user(user_id, bot, is_reminder=True)
+    await run_resumable_broadcast("send_daily_reminder", bot)
 
-async def ask_for_weekly_feedback(bot: Bot):
-    users = await db.get_all_active_users()
+def _weekly_feedback(bot: Bot, after_user_id: int):
     feedback_text = "🗓️ **Час для тижневого відгуку!**\n\nЯк ви оцінюєте складність тренувань минулого тижня? (де 1 - дуже легко, 5 - дуже важко)"
-    for user_id, *_ in users:
-        try:
-            await send_message_safely(bot, user_id, feedback_text, reply_markup=kb.feedback_kb)
-        except Exception as e:
-            print(f"Не вдалося надіслати тижневий відгук користувачу {user_id}: {e}")
+    return to_each(db.iter_active_users(after_user_id), feedback_text, reply_markup=kb.feedback_kb)
+
+async def ask_for_weekly_feedback(bot: Bot):
+    await run_resumable_broadcast("ask_for_weekly_feedback", bot)
+
+async def _monthly_reports(bot: Bot, after_user_id: int):
+    # Усі, хто з ботом понад 30 днів, отримують 'marathoner' одним запитом (повторно - ігнорується)
+    registered_before = (get_current_kyiv_time() - timedelta(days=30)).isoformat()
+    granted = await achievements.grant_achievement_in_bulk('marathoner', registered_before)
+    if granted:
+        print(f"Видано досягнення 'marathoner': {granted}")
+
+    today = db.day_number()
+    async for stats in db.iter_monthly_stats(after_user_id):
+        total_workouts = stats['total'] or 0
+        last_30_days = db.count_recent_workouts(stats, 30, today)
+        report_text = (f"📅 **Ваш звіт за місяць!**\n\nВи чудово попрацювали! Ось ваша статистика:\n🔸 Тренувань за останній місяць: **{last_30_days}**\n🔸 Всього тренувань з ботом: **{total_workouts}**\n\nНовий місяць - нові вершини! Не зупиняйтесь!")
+        yield stats['user_id'], report_text, {}
 
 async def send_monthly_report(bot: Bot):
-    users = await db.get_all_active_users()
-    for user_data in users:
-        try:
-            user_id = user_data[0]
-            reg_date_str = user_data[1] if len(user_data) > 1 else None
-
-            if not reg_date_str: continue
-            reg_date = datetime.fromisoformat(reg_date_str)
-            if datetime.now() - reg_date > timedelta(days=30):
-                await achievements.check_and_grant_achievement(user_id, 'marathoner', bot)
-            
-            total_workouts = await db.count_total_workouts(user_id)
-            last_30_days = await db.count_workouts_last_n_days(user_id, 30)
-            report_text = (f"📅 **Ваш звіт за місяць!**\n\nВи чудово попрацювали! Ось ваша статистика:\n🔸 Тренувань за останній місяць: **{last_30_days}**\n🔸 Всього тренувань з ботом: **{total_workouts}**\n\nНовий місяць - нові вершини! Не зупиняйтесь!")
-            await send_message_safely(bot, user_id, report_text)
-        except Exception as e:
-            print(f"Не вдалося надіслати місячний звіт користувачу! {user_id}: {e}")
+    await run_resumable_broadcast("send_monthly_report", bot)
 
 async def post_weekly_leaderboard(bot: Bot):
     if not GROUP_ID: return
-    top_users = await db.get_top_users_by_workouts(limit=3)
+    top_users = leaderboard.top(3)
     if not top_users: return
+    usernames = await db.get_usernames([user_id for user_id, _ in top_users])
     leaderboard_text = "🏆 **Щотижневий Лідерборд!** 🏆\n\nОсь наші найактивніші спортсмени за минулий тиждень:\n\n"
     medals = ["🥇", "🥈", "🥉"]
-    for i, (user_id, username, workout_count) in enumerate(top_users):
+    for i, (user_id, workout_count) in enumerate(top_users):
+        username = usernames.get(user_id)
         display_name = f"@{username}" if username else f"User {user_id}"
         leaderboard_text += f"{medals[i]} {display_name} - **{workout_count}** тренувань\n"
     leaderboard_text += "\nВітаємо лідерів та бажаємо всім продуктивного нового тижня!"
-    await send_message_safely(bot, int(GROUP_ID), leaderboard_text)
-
-async def remind_to_join_group(bot: Bot):
-    if not GROUP_INVITE_LINK: return
-    users_not_in_group = await db.get_users_not_in_group()
-    if not users_not_in_group: return
+    await enqueue(int(GROUP_ID), leaderboard_text)
 
+def _join_group_reminders(bot: Bot, after_user_id: int):
     group_invite_kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Приєднатись до спільноти", url=GROUP_INVITE_LINK)]
     ])
     reminder_text = "👋 Привіт! Нагадуємо, що у нас є закрита спільнота, де ви можете ділитися успіхами, брати участь у групових челенджах та отримувати додаткову мотивацію. Долучайтеся!"
-    for (user_id,) in users_not_in_group:
-        try:
-            await send_message_safely(bot, user_id, reminder_text, reply_markup=group_invite_kb)
-        except Exception as e:
-            print(f"Не вдалося надіслати нагадування про групу користувачу {user_id}: {e}")
+    return to_each(db.iter_users_not_in_group(after_user_id), reminder_text, reply_markup=group_invite_kb)
 
+async def remind_to_join_group(bot: Bot):
+    if not GROUP_INVITE_LINK: return
+    await run_resumable_broadcast("remind_to_join_group", bot)
 
-async def send_bedtime_reminder(bot: Bot):
-    users = await db.get_all_active_users()
+
+def _bedtime_reminders(bot: Bot, after_user_id: int):
     text = "🌙 Пора лягати спати! Гарного відпочинку 😴"
-    for user_id, *_ in users:
-        try:
-            await send_message_safely(bot, user_id, text)
-        except Exception as e:
-            print(f"Не вдалося надіслати нагадування про сон користувачу {user_id}: {e}")
+    return to_each(db.iter_active_users(after_user_id), text)
 
-async def ask_daily_activity(bot: Bot):
-    users = await db.get_all_active_users()
+async def send_bedtime_reminder(bot: Bot):
+    await run_resumable_broadcast("send_bedtime_reminder", bot)
+
+def _daily_activity_questions(bot: Bot, after_user_id: int):
     builder = InlineKeyboardBuilder()
     builder.button(text="Пасивний 🧘", callback_data="set_activity:passive")
     builder.button(text="Середній 🚶‍♂️", callback_data="set_activity:medium")
     builder.button(text="Активний 🏋️", callback_data="set_activity:active")
     builder.adjust(3)
     
-    for user_id, *_ in users:
-        await send_message_safely(bot, user_id, "Доброго ранку! Який у вас сьогодні план на активність?", reply_markup=builder.as_markup())
+    text = "Доброго ранку! Який у вас сьогодні план на активність?"
+    return to_each(db.iter_active_users(after_user_id), text, reply_markup=builder.as_markup())
+
+async def ask_daily_activity(bot: Bot):
+    await run_resumable_broadcast("ask_daily_activity", bot)
+
+async def _evening_reports(analyses: dict, recipients: dict):
+    """Звіти всіх користувачів; аналіз для кожного нового ключа запускається одразу."""
+    async for totals in db.iter_daily_nutrition(db.day_start_epoch()):
+        user_id = totals['user_id']
+        if not totals['meals']:
+            yield user_id, NO_MEALS_TEXT, {}
+            continue
+        key = daily_analysis_key(totals['goal'], totals['calories'], totals['daily_activity_level'])
+        if key not in analyses:
+            analyses[key] = asyncio.create_task(_keyed_analysis(key))
+            recipients[key] = []
+        recipients[key].append(user_id)
+        yield user_id, build_daily_report(totals), {}
+
+async def _keyed_analysis(key: tuple):
+    return key, await get_daily_analysis(key)
 
 async def send_evening_summary(bot: Bot):
-    users = await db.get_all_active_users()
-    for user_id, *_ in users:
-        try:
-            print(f"[LOG] Відправляю вечірній звіт користувачу {user_id}")
-            try:
-                await send_daily_summary(user_id, bot)
-                print(f"[LOG] Звіт успішно надіслано користувачу {user_id}")
-            except Exception as e:
-                print(f"[ERROR] send_daily_summary не вдалося для {user_id}: {e}")
-        except Exception as e:
-            print(f"[ERROR] Не вдалося надіслати вечірній звіт користувачу {user_id}: {e}")
+    """
+    Вечірній звіт конвеєром: підсумки всіх користувачів одним запитом, аналізи Gemini
+    паралельно (з кешем за ціллю, діапазоном калорій та активністю), а кожен готовий
+    аналіз одразу ставиться в чергу всім користувачам з таким самим ключем.
+    """
+    analyses, recipients = {}, {}
+    # Аналіз іде в той самий слот вікна, що й звіт, тому надходить одразу після нього
+    send_at, window = db.now_epoch(), await get_delivery_window("send_evening_summary")
+    try:
+        await broadcast("send_evening_summary", _evening_reports(analyses, recipients), window, send_at)
+    except Exception:
+        for task in analyses.values():
+            task.cancel()
+        raise
+    for finished in asyncio.as_completed(analyses.values()):
+        key, analysis_text = await finished
+        await enqueue_many([(user_id, analysis_text, {}) for user_id in recipients[key]], send_at, window=window)
+    print(f"[LOG] Вечірні аналізи: {len(analyses)} унікальних для {sum(map(len, recipients.values()))} користувачів")
+
+MEAL_REMINDER_NAMES = {
+    "breakfast": "сніданку 🍳",
+    "lunch": "обіду 🍲",
+    "dinner": "вечері 🥗",
+}
+
+async def _meal_reminders(due):
+    reminded = set()
+    for user_id, meal in due:
+        # Один прийом їжі на користувача, навіть якщо кілька нагадувань збіглися в часі
+        if user_id in reminded:
+            continue
+        reminded.add(user_id)
+        text = f"Час для {MEAL_REMINDER_NAMES[meal]}! Не забудьте записати свій прийом їжі."
+        kb_markup = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Записати їжу", callback_data=f"log_meal:{meal}")]
+        ])
+        yield user_id, text, {"reply_markup": kb_markup}
 
 async def send_meal_reminders(bot: Bot):
     """Нагадування про прийоми їжі для користувачів."""
     current_time = get_current_kyiv_time().strftime("%H:%M")
-    user_reminders = await db.get_all_user_reminders()
-
-    for user_id, breakfast, lunch, dinner in user_reminders:
-        reminder_to_send = None
-        if breakfast == current_time:
-            reminder_to_send = ("сніданку 🍳", "breakfast")
-        elif lunch == current_time:
-            reminder_to_send = ("обіду 🍲", "lunch")
-        elif dinner == current_time:
-            reminder_to_send = ("вечері 🥗", "dinner")
-
-        if reminder_to_send:
-            text = f"Час для {reminder_to_send[0]}! Не забудьте записати свій прийом їжі."
-            kb_markup = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="✅ Записати їжу", callback_data=f"log_meal:{reminder_to_send[1]}")]
-            ])
-            try:
-                await send_message_safely(bot, user_id, text, reply_markup=kb_markup)
-            except Exception as e:
-                print(f"Не вдалося надіслати нагадування про їжу {user_id}: {e}")
+    due = await db.get_due_meal_reminders(current_time)
+    if due:
+        await broadcast("send_meal_reminders", _meal_reminders(due))
+
+async def expire_subscriptions(bot: Bot):
+    """Завершує всі прострочені підписки одним запитом і сповіщає користувачів."""
+    expired_ids = await db.expire_lapsed_subscriptions()
+    text = "Термін дії вашої підписки закінчився. Будь ласка, поновіть її, щоб продовжити користуватись усіма функціями бота."
+    await broadcast("expire_subscriptions",
+                    ((user_id, text, {"reply_markup": kb.subscribe_kb}) for user_id in expired_ids))
+
+# Розсилки по всій базі з контрольними точками: назва -> (bot, after_user_id) -> потік повідомлень
+RESUMABLE_BROADCASTS = {
+    "send_daily_reminder": _daily_reminders,
+    "ask_for_weekly_feedback": _weekly_feedback,
+    "send_monthly_report": _monthly_reports,
+    "remind_to_join_group": _join_group_reminders,
+    "send_bedtime_reminder": _bedtime_reminders,
+    "ask_daily_activity": _daily_activity_questions,
+}
+RESUME_MAX_AGE = timedelta(hours=6)  # старіші перервані розсилки вже неактуальні
+
+# Вікна доставки розсилок за замовчуванням (хвилини), оголошуються в setup_scheduler;
+# адмін може перевизначити їх командою /set_window
+DELIVERY_WINDOWS: dict[str, int] = {}
+
+async def get_delivery_window(job: str) -> int:
+    """Повертає вікно доставки задачі в секундах."""
+    overrides = await db.get_broadcast_windows()
+    return overrides.get(job, DELIVERY_WINDOWS.get(job, 0)) * 60
+
+async def run_resumable_broadcast(job: str, bot: Bot, run_id: str | None = None):
+    """Запускає розсилку з реєстру; один запуск на задачу за день."""
+    run_id = run_id or f"{job}:{get_current_kyiv_time().date().isoformat()}"
+    make_deliveries = RESUMABLE_BROADCASTS[job]
+    window = await get_delivery_window(job)
+    await run_broadcast(run_id, job, lambda after_user_id: make_deliveries(bot, after_user_id), window)
+
+async def resume_broadcasts(bot: Bot):
+    """Продовжує розсилки, перервані перезапуском бота."""
+    started_after = db.to_epoch(get_current_kyiv_time() - RESUME_MAX_AGE)
+    for run in await db.get_interrupted_broadcast_runs(started_after):
+        if run['job'] not in RESUMABLE_BROADCASTS:
+            continue
+        try:
+            await run_resumable_broadcast(run['job'], bot, run['run_id'])
+        except Exception as e:
+            print(f"Не вдалося продовжити розсилку {run['run_id']}: {e}")
+
+JOB_DEFAULTS = {
+    "coalesce": True,             # пропущені запуски виконуються один раз
+    "misfire_grace_time": 3600,   # секунд, протягом яких запізнілий запуск ще виконується
+}
+
+async def sweep_expired_challenges():
+    """Видаляє челенджі, термін яких минув."""
+    deleted = await db.delete_expired_challenges()
+    if deleted:
+        print(f"Видалено завершені челенджі: {deleted}")
+
+def add_windowed_job(scheduler: AsyncIOScheduler, func, window_minutes: int, trigger: str, **trigger_args):
+    """
+    Додає задачу-розсилку, повідомлення якої рівномірно розподіляються по вікну доставки
+    window_minutes від часу запуску (слот користувача визначається хешем його user_id).
+    """
+    DELIVERY_WINDOWS[func.__name__] = window_minutes
+    scheduler.add_job(func, trigger, **trigger_args)
 
 def setup_scheduler(bot: Bot):
-    scheduler = AsyncIOScheduler(timezone=KYIV_TZ)
+    scheduler = AsyncIOScheduler(timezone=KYIV_TZ, job_defaults=JOB_DEFAULTS)
 
-    scheduler.add_job(send_daily_reminder, 'cron', hour=7, minute=30, args=(bot,))
-    scheduler.add_job(ask_for_weekly_feedback, 'cron', day_of_week='sun', hour=19, minute=0, args=(bot,))
-    scheduler.add_job(send_monthly_report, 'cron', day=1, hour=10, minute=0, args=(bot,))
+    add_windowed_job(scheduler, send_daily_reminder, 15, 'cron', hour=7, minute=30, args=(bot,))
+    add_windowed_job(scheduler, ask_for_weekly_feedback, 15, 'cron', day_of_week='sun', hour=19, minute=0, args=(bot,))
+    add_windowed_job(scheduler, send_monthly_report, 30, 'cron', day=1, hour=10, minute=0, args=(bot,))
     scheduler.add_job(post_weekly_leaderboard, 'cron', day_of_week='sun', hour=20, minute=0, args=(bot,))
-    scheduler.add_job(remind_to_join_group, 'cron', day_of_week='tue,fri', hour=12, minute=0, args=(bot,))
-    scheduler.add_job(send_evening_summary, 'cron', hour=21, minute=30, args=(bot,))
+    add_windowed_job(scheduler, remind_to_join_group, 30, 'cron', day_of_week='tue,fri', hour=12, minute=0, args=(bot,))
+    add_windowed_job(scheduler, send_evening_summary, 15, 'cron', hour=21, minute=30, args=(bot,))
     scheduler.add_job(send_meal_reminders, 'cron', minute='*', args=(bot,))
-    scheduler.add_job(send_bedtime_reminder, 'cron', hour=22, minute=0, args=(bot,))
+    add_windowed_job(scheduler, send_bedtime_reminder, 10, 'cron', hour=22, minute=0, args=(bot,))
+    scheduler.add_job(expire_subscriptions, 'interval', minutes=5, args=(bot,))
+    # Перше очищення одразу після старту, щоб підхопити челенджі, що завершились під час простою
+    scheduler.add_job(sweep_expired_challenges, 'interval', minutes=5, next_run_time=get_current_kyiv_time())
 
     if not scheduler.running:
         scheduler.start()
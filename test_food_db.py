@@ -0,0 +1,91 @@
+import pytest
+
+import food_db
+
+
+@pytest.fixture(autouse=True)
+def bundled_table():
+    food_db.load()
+    yield
+    food_db.load()
+
+
+def test_bundled_table_has_no_ambiguous_names(capsys):
+    food_db.load()
+    output = capsys.readouterr().out
+    assert "Неоднозначна основа" not in output
+    assert "вже належить" not in output
+
+
+def test_parse_items_splits_quantities():
+    assert food_db.parse_items("200г гречки і 2 яйця") == [("гречки", 200, "г"), ("яйця", 2, None)]
+    assert food_db.parse_items("150 гр курячої грудки, рис 200г, огірок") == [
+        ("курячої грудки", 150, "г"), ("рис", 200, "г"), ("огірок", None, None)
+    ]
+    assert food_db.parse_items("1,5 л води") == [("води", 1.5, "л")]
+    assert food_db.parse_items("сирники 3 шт") == [("сирники", 3, "шт")]
+
+
+def test_estimate_meal_with_quantities():
+    meal = food_db.estimate_meal("200г гречки і 2 яйця")
+    assert meal["meal_name"] == "Гречка (200 г), Яйце (110 г)"
+    assert meal["calories"] == round(110 * 2 + 155 * 1.1)
+    assert food_db.estimate_meal("сирники 3 шт")["meal_name"] == "Сирники (180 г)"
+    assert food_db.estimate_meal("1 кг кавуна")["meal_name"] == "Кавун (1000 г)"
+
+
+def test_water_is_not_vodka():
+    meal = food_db.estimate_meal("1.5 л води")
+    assert meal["meal_name"] == "Вода (1500 г)"
+    assert meal["calories"] == 0
+    assert food_db.estimate_meal("водка 100 мл")["meal_name"] == "Горілка (100 г)"
+
+
+def test_inflected_forms_and_side_dishes():
+    assert food_db.estimate_meal("кефіру 250 мл")["meal_name"] == "Кефір (250 г)"
+    assert food_db.estimate_meal("вівсянка з бананом")["meal_name"] == "Вівсянка (250 г), Банан (120 г)"
+    assert food_db.estimate_meal("борщ зі сметаною")["meal_name"] == "Борщ (300 г), Сметана (30 г)"
+
+
+def test_bare_dish_names_use_portion():
+    assert food_db.estimate_meal("пельмені")["meal_name"] == "Пельмені (250 г)"
+    assert food_db.estimate_meal("вареники з картоплею")["meal_name"] == "Вареники з картоплею (250 г)"
+    assert food_db.estimate_meal("суші")["meal_name"] == "Суші (250 г)"
+    assert food_db.estimate_meal("млинці")["meal_name"] == "Млинці (150 г)"
+    assert food_db.estimate_meal("печиво")["meal_name"] == "Печиво (30 г)"
+    assert food_db.estimate_meal("тефтелі")["meal_name"] == "Тефтелі (200 г)"
+    assert food_db.estimate_meal("сирники зі сметаною")["meal_name"] == "Сирники (200 г)"
+    # Явна кількість рахується штуками
+    assert food_db.estimate_meal("2 млинці")["meal_name"] == "Млинці (100 г)"
+
+
+def test_unclear_quantities_fall_through_to_gemini():
+    # Порція яйця - одна штука, а скільки "яйця" - невідомо
+    assert food_db.estimate_meal("яйця") is None
+    assert food_db.estimate_meal("яйце")["meal_name"] == "Яйце (55 г)"
+    assert food_db.estimate_meal("омлет з 3 яєць") is None
+    assert food_db.estimate_meal("2 пиво") is None
+    # "сир" - і кисломолочний, і твердий; "сидр" - лише схоже слово
+    assert food_db.estimate_meal("сир") is None
+    assert food_db.estimate_meal("макарони з сиром") is None
+    assert food_db.estimate_meal("бутерброд з маслом і сиром") is None
+
+
+def test_unknown_items_fall_through_to_gemini():
+    assert food_db.estimate_meal("щось дивне") is None
+    # Одна нерозпізнана позиція - весь опис віддається Gemini
+    assert food_db.estimate_meal("борщ і щось дивне") is None
+
+
+def test_shared_stem_is_not_used(tmp_path, capsys):
+    table = tmp_path / "foods.csv"
+    table.write_text(
+        "name,aliases,calories,proteins,fats,carbs,portion,piece\n"
+        "вода,,0,0,0,0,250,\n"
+        "водо,,100,0,0,0,100,\n",
+        encoding="utf-8",
+    )
+    food_db.load(str(table))
+    assert "Неоднозначна основа 'вод'" in capsys.readouterr().out
+    assert food_db.find_food("води") != (None, 0)
+    assert food_db.find_food("води")[1] < food_db.MIN_SCORE
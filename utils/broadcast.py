@@ -0,0 +1,107 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+from utils.safe_sender import is_chat_unreachable, send_message_safely
+
+# Telegram дозволяє ~30 повідомлень/с на бота; лишаємо запас для інтерактивних відповідей
+BROADCAST_RATE = 25
+BROADCAST_CONCURRENCY = 10
+
+# (chat_id, текст, додаткові аргументи для send_message)
+Delivery = Tuple[int, str, dict]
+
+
+class TokenBucket:
+    """Глобальний обмежувач швидкості: не більше `rate` повідомлень на секунду."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Зупиняє всі відправки на `seconds` (відповідь Telegram з retry_after)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+rate_limiter = TokenBucket(BROADCAST_RATE)
+
+
+@dataclass
+class BroadcastStats:
+    name: str
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    started: float = field(default_factory=time.monotonic)
+    finished: float = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self) -> float:
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"[BROADCAST] {self.name}: надіслано {self.sent}, помилок {self.failed}, "
+            f"повторів {self.retries}, {self.elapsed:.1f} с ({self.rate:.1f} повід./с)"
+        )
+
+
+SENT, RETRY, FAILED, UNREACHABLE = "sent", "retry", "failed", "unreachable"
+
+
+async def send_once(bot: Bot, chat_id: int, text: str, kwargs: dict):
+    """
+    Одна спроба відправки під глобальним лімітом.
+    Повертає (результат, затримка до повтору від Telegram або None, помилка або None).
+    """
+    await rate_limiter.acquire()
+    try:
+        await send_message_safely(bot, chat_id, text, **kwargs)
+        return SENT, None, None
+    except TelegramRetryAfter as e:
+        # Флуд-контроль стосується всього бота, тому пригальмовуємо всі відправки
+        rate_limiter.pause(e.retry_after)
+        return RETRY, e.retry_after, e
+    except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError) as e:
+        return RETRY, None, e
+    except Exception as e:
+        return (UNREACHABLE if is_chat_unreachable(e) else FAILED), None, e
+
+
+async def send_all(bot: Bot, deliveries: list[Delivery], concurrency: int = BROADCAST_CONCURRENCY) -> list:
+    """Надсилає пакет повідомлень паралельно (не більше concurrency одночасно), зберігаючи порядок результатів."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(delivery: Delivery):
+        async with semaphore:
+            return await send_once(bot, *delivery)
+
+    return await asyncio.gather(*(send(delivery) for delivery in deliveries))
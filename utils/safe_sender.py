@@ -1,6 +1,12 @@
+import asyncio
+import time
+
 from aiogram import Bot
 from aiogram.types import Message
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNotFound, TelegramRetryAfter
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+STREAM_EDIT_INTERVAL = 1.0  # секунд між редагуваннями повідомлення під час генерації
 
 async def send_message_safely(bot: Bot, chat_id: int, text: str, **kwargs):
     """
@@ -22,3 +28,97 @@ async def answer_message_safely(message: Message, text: str, **kwargs):
         kwargs.pop('parse_mode', None)
         await message.answer(text, **kwargs)
 
+
+def is_chat_unreachable(error: Exception) -> bool:
+    """
+    Чи означає помилка відправки, що користувач заблокував бота або видалив акаунт.
+    """
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, (TelegramBadRequest, TelegramNotFound)) and "chat not found" in str(error).lower()
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """
+    Ділить текст на частини не довші за limit, по можливості між абзацами, рядками або словами.
+    Межа частини залежить лише від її перших limit символів, тож при дописуванні тексту
+    вже сформовані частини не змінюються.
+    """
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+class ProgressiveMessage:
+    """
+    Відповідь, що з'являється в міру генерації: заглушка редагується не частіше
+    ніж раз на interval секунд, а текст понад ліміт Telegram переноситься
+    в наступні повідомлення.
+    """
+
+    def __init__(self, message: Message, placeholder: str = "✍️ ...", interval: float = STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.placeholder = placeholder
+        self.interval = interval
+        self.parts: list[Message] = []
+        self.shown: list[str] = []
+        self.last_edit = 0.0
+
+    async def start(self):
+        """Надсилає заглушку, яку потім замінить згенерований текст."""
+        self.parts.append(await self.message.answer(self.placeholder))
+        self.shown.append(self.placeholder)
+        self.last_edit = time.monotonic()
+
+    async def update(self, text: str):
+        """Показує поточний текст, якщо з останнього редагування минуло достатньо часу."""
+        if not text.strip() or time.monotonic() - self.last_edit < self.interval:
+            return
+        await self._render(split_message(text))
+
+    async def finish(self, text: str, **kwargs):
+        """Показує остаточний текст; kwargs (наприклад parse_mode) застосовуються до всіх частин."""
+        chunks = split_message(text)
+        await self._render(chunks, force=bool(kwargs), **kwargs)
+        # Якщо фінальний текст коротший за проміжний (наприклад, помилка), прибираємо зайві частини
+        for extra in self.parts[len(chunks):]:
+            try:
+                await extra.delete()
+            except TelegramBadRequest:
+                pass
+        del self.parts[len(chunks):], self.shown[len(chunks):]
+
+    async def _render(self, chunks: list[str], force: bool = False, **kwargs):
+        for i, chunk in enumerate(chunks):
+            if i < len(self.parts):
+                if force or self.shown[i] != chunk:
+                    await _with_fallback(self.parts[i].edit_text, chunk, **kwargs)
+            else:
+                self.parts.append(await _with_fallback(self.message.answer, chunk, **kwargs))
+            self.shown[i:i + 1] = [chunk]
+        self.last_edit = time.monotonic()
+
+
+async def _with_fallback(method, text: str, **kwargs):
+    """Надсилання або редагування з очікуванням флуд-контролю та переходом на звичайний текст."""
+    try:
+        return await method(text, **kwargs)
+    except TelegramRetryAfter as e:
+        await asyncio.sleep(e.retry_after)
+        return await method(text, **kwargs)
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            return None
+        kwargs.pop('parse_mode', None)
+        return await method(text, **kwargs)